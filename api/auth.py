@@ -1,7 +1,8 @@
+import asyncio
+
 from fastapi import APIRouter, UploadFile, File, Form,  HTTPException, Response
-from services import auth_service
+from services import auth_service, avatar_service
 from core.config import settings
-from core.security import bytes_to_base64
 from models.user import UserOut, LoginIn
 from typing import Optional
 
@@ -28,25 +29,28 @@ async def register(
         raise HTTPException(status_code=400, detail="Email already exists")
 
     # handle avatar input
-    avatar_bytes = None
+    avatar_id = None
     avatar_url_to_store = None
-    if avatar:
-        # user uploaded a file - store as bytes
-        avatar_bytes = await avatar.read()
-    elif avatar_url:
+    if not avatar and not avatar_url:
+        raise HTTPException(status_code=400, detail="Avatar required (upload or select one)")
+    if not avatar:
         # user selected a predefined avatar - store the URL
         avatar_url_to_store = avatar_url
-    else:
-        raise HTTPException(status_code=400, detail="Avatar required (upload or select one)")
-
-    # create user
-    user = await auth_service.create_user(username, email, password, avatar_bytes, avatar_url_to_store)
 
-    # prepare response avatar
-    if avatar_bytes:
-        avatar_response = bytes_to_base64(avatar_bytes)
-    else:
-        avatar_response = avatar_url_to_store
+    try:
+        if avatar:
+            # user uploaded a file - resize it into the avatar store
+            avatar_id = await avatar_service.store_avatar(await avatar_service.read_upload(avatar))
+        # create user
+        try:
+            user = await auth_service.create_user(username, email, password, avatar_id, avatar_url_to_store)
+        except BaseException:
+            # saturated hash pool, a lost username race, a dropped client: don't orphan the thumbnails
+            if avatar_id:
+                await asyncio.shield(avatar_service.release_avatar(avatar_id))
+            raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     
     
     # Create JWT token and set cookie so user is automatically logged in after signup
@@ -64,7 +68,7 @@ async def register(
         "_id": str(user["_id"]),
         "username": user["username"],
         "email": user["email"],
-        "avatar": avatar_response
+        "avatar": avatar_service.avatar_url(user)
     }
 
     return user_out
@@ -1,30 +1,81 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, Form, Request
 from typing import Optional
 from api.users import get_current_user
-from services.pdf_chat_service import chat_with_pdf
+from core.sse import stream_answer
+from core.workers import WorkerPoolSaturated
+from services.pdf_chat_service import chat_with_pdf, chat_with_document, ingest_pdf, stream_chat_with_document
+from services.pdf_index_service import get_document
+from services.upload_service import UploadTooLarge, spool_pdf_request, release_spooled
 from services.subject_service import get_subject, append_pdf_chat_to_subject
 
 router = APIRouter(prefix="/chat-pdf", tags=["chat-pdf"])
 
 
-@router.post("/")
+# The upload routes parse their multipart body themselves (see spool_pdf_request), so the
+# form is described here for the OpenAPI docs instead of through File/Form parameters.
+def _upload_form(*fields: str) -> dict:
+    properties = {"pdf_file": {"type": "string", "format": "binary"}}
+    properties.update({name: {"type": "string"} for name in fields})
+    required = ["pdf_file", "message"] if "message" in fields else ["pdf_file"]
+    schema = {"type": "object", "properties": properties, "required": required}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": schema}}}}
+
+_CHAT_FORM = _upload_form("message", "subject_id", "session_id", "bypass_cache")
+
+
+async def _pdf_upload(request: Request):
+    """Spool the `pdf_file` part as it arrives; the spool file is removed once the request is done."""
+    try:
+        spooled, fields = await spool_pdf_request(request)
+    except UploadTooLarge as ut:
+        raise HTTPException(status_code=413, detail=str(ut))
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    if spooled is None:
+        raise HTTPException(status_code=400, detail="pdf_file is required")
+    try:
+        yield {**spooled, "fields": fields}
+    finally:
+        release_spooled(spooled["path"])
+
+
+def _chat_fields(upload: dict) -> dict:
+    fields = upload["fields"]
+    if not fields.get("message"):
+        raise HTTPException(status_code=400, detail="message is required")
+    return {
+        "message": fields["message"],
+        "subject_id": fields.get("subject_id") or None,
+        "session_id": fields.get("session_id") or None,
+        "bypass_cache": fields.get("bypass_cache", "").lower() in ("1", "true", "on", "yes"),
+    }
+
+
+@router.post("/", openapi_extra=_CHAT_FORM)
 async def chat_pdf_endpoint(
-    pdf_file: UploadFile = File(...),
-    message: str = Form(...),
-    subject_id: Optional[str] = Form(None),
+    current_user: dict = Depends(get_current_user),
+    upload: dict = Depends(_pdf_upload),
 ):
-    # read file bytes
-    file_bytes = await pdf_file.read()
+    # the upload was streamed to a spool file and hashed as it arrived
+    form = _chat_fields(upload)
+    message, subject_id = form["message"], form["subject_id"]
 
     # run the PDF chat
     try:
-        answer = await chat_with_pdf(file_bytes, message)
+        result = await chat_with_pdf(
+            upload["path"], upload["sha256"], message,
+            user_id=current_user["_id"], session_id=form["session_id"], filename=upload["filename"],
+            bypass_cache=form["bypass_cache"],
+        )
+    except WorkerPoolSaturated:
+        raise  # 503 with Retry-After, see main.py
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except RuntimeError as re:
         raise HTTPException(status_code=500, detail=str(re))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process PDF: {e}")
+    answer = result["answer"]
 
     # optionally save conversation under subject
     if subject_id:
@@ -32,8 +83,137 @@ async def chat_pdf_endpoint(
         if not subj:
             raise HTTPException(status_code=404, detail="Subject not found")
         try:
-            await append_pdf_chat_to_subject(subject_id, message, answer, pdf_filename=pdf_file.filename, added_by=current_user.get("_id"))
+            await append_pdf_chat_to_subject(subject_id, message, answer, pdf_filename=upload["filename"], added_by=current_user.get("_id"))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to save conversation: {e}")
 
-    return {"answer": answer, "saved": bool(subject_id)}
+    return {"answer": answer, "saved": bool(subject_id), "cached": result["cached"], "timings": result["timings"]}
+
+
+@router.post("/documents", openapi_extra=_upload_form())
+async def upload_document(
+    current_user: dict = Depends(get_current_user),
+    upload: dict = Depends(_pdf_upload),
+):
+    """Index a PDF once; later questions reference it by the returned document_id."""
+    try:
+        doc = await ingest_pdf(upload["path"], upload["sha256"], filename=upload["filename"])
+    except WorkerPoolSaturated:
+        raise  # 503 with Retry-After, see main.py
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except RuntimeError as re:
+        raise HTTPException(status_code=500, detail=str(re))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to process PDF: {e}")
+    return doc
+
+
+@router.get("/documents/{document_id}")
+async def get_document_endpoint(document_id: str, current_user: dict = Depends(get_current_user)):
+    doc = await get_document(document_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return doc
+
+
+@router.post("/documents/{document_id}/ask")
+async def ask_document(
+    document_id: str,
+    message: str = Form(...),
+    subject_id: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+    bypass_cache: bool = Form(False),
+    current_user: dict = Depends(get_current_user),
+):
+    doc = await get_document(document_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    try:
+        result = await chat_with_document(
+            document_id, message, user_id=current_user["_id"], session_id=session_id, bypass_cache=bypass_cache,
+        )
+    except WorkerPoolSaturated:
+        raise  # 503 with Retry-After, see main.py
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except RuntimeError as re:
+        raise HTTPException(status_code=500, detail=str(re))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to process PDF: {e}")
+    answer = result["answer"]
+
+    if subject_id:
+        subj = await get_subject(subject_id)
+        if not subj:
+            raise HTTPException(status_code=404, detail="Subject not found")
+        try:
+            await append_pdf_chat_to_subject(subject_id, message, answer, pdf_filename=doc.get("filename"), added_by=current_user.get("_id"))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to save conversation: {e}")
+
+    return {"answer": answer, "document_id": document_id, "saved": bool(subject_id), "cached": result["cached"], "timings": result["timings"]}
+
+
+def _save_pdf_chat(subject_id: Optional[str], question: str, pdf_filename: Optional[str], user_id: str):
+    async def on_complete(answer: str) -> dict:
+        if not subject_id:
+            return {"saved": False, "subject_id": None}
+        try:
+            await append_pdf_chat_to_subject(subject_id, question, answer, pdf_filename=pdf_filename, added_by=user_id)
+        except Exception as e:
+            return {"saved": False, "subject_id": subject_id, "detail": f"Failed to save conversation: {e}"}
+        return {"saved": True, "subject_id": subject_id}
+    return on_complete
+
+
+@router.post("/stream", openapi_extra=_CHAT_FORM)
+async def chat_pdf_stream_endpoint(
+    current_user: dict = Depends(get_current_user),
+    upload: dict = Depends(_pdf_upload),
+):
+    """Server-Sent Events variant of POST /chat-pdf/: `token` events, then a `done` event with the save status."""
+    form = _chat_fields(upload)
+    message, subject_id = form["message"], form["subject_id"]
+    if subject_id and not await get_subject(subject_id):
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+    try:
+        doc = await ingest_pdf(upload["path"], upload["sha256"], filename=upload["filename"])
+    except WorkerPoolSaturated:
+        raise  # 503 with Retry-After, see main.py
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except RuntimeError as re:
+        raise HTTPException(status_code=500, detail=str(re))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to process PDF: {e}")
+
+    tokens = stream_chat_with_document(
+        doc["document_id"], message, user_id=current_user["_id"], session_id=form["session_id"],
+        bypass_cache=form["bypass_cache"],
+    )
+    return stream_answer(tokens, _save_pdf_chat(subject_id, message, upload["filename"], current_user["_id"]))
+
+
+@router.post("/documents/{document_id}/ask/stream")
+async def ask_document_stream(
+    document_id: str,
+    message: str = Form(...),
+    subject_id: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+    bypass_cache: bool = Form(False),
+    current_user: dict = Depends(get_current_user),
+):
+    """Server-Sent Events variant of POST /chat-pdf/documents/{document_id}/ask."""
+    doc = await get_document(document_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if subject_id and not await get_subject(subject_id):
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+    tokens = stream_chat_with_document(
+            document_id, message, user_id=current_user["_id"], session_id=session_id, bypass_cache=bypass_cache,
+        )
+    return stream_answer(tokens, _save_pdf_chat(subject_id, message, doc.get("filename"), current_user["_id"]))
@@ -1,29 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException, Path
-from api.users import get_current_user
-from models.message import MessageCreate, MessageOut
-from services.message_service import create_message, list_messages
-from services.playground_service import get_playground
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from api.users import get_current_user, get_current_user_id
+from core.config import settings
+from models.message import MessageCreate, MessageOut, MessagePage
+from services.message_service import create_message, list_messages, page_messages
+from api.playgrounds import require_member
 
 router = APIRouter(prefix="/playgrounds/{playground_id}/messages", tags=["messages"])
 
 @router.post("/", response_model=MessageOut)
 async def post_message(playground_id: str, payload: MessageCreate, current_user: dict = Depends(get_current_user)):
-    pg = await get_playground(playground_id)
-    if not pg:
-        raise HTTPException(status_code=404, detail="Playground not found")
-    if current_user["_id"] not in pg["members"]:
-        raise HTTPException(status_code=403, detail="Not a member")
+    await require_member(playground_id, current_user["_id"])
     # create playground-level message
     msg = await create_message(playground_id, current_user["_id"], payload.content, current_user.get("username"))
     return msg
 
 
 @router.get("/", response_model=list[MessageOut])
-async def get_messages(playground_id: str, current_user: dict = Depends(get_current_user)):
-    pg = await get_playground(playground_id)
-    if not pg:
-        raise HTTPException(status_code=404, detail="Playground not found")
-    if current_user["_id"] not in pg["members"]:
-        raise HTTPException(status_code=403, detail="Not a member")
+async def get_messages(playground_id: str, user_id: str = Depends(get_current_user_id)):
+    """The latest 100 messages, oldest first. Use /history to page through the rest."""
+    await require_member(playground_id, user_id)
     msgs = await list_messages(playground_id)
     return msgs
+
+
+@router.get("/history", response_model=MessagePage)
+async def get_message_history(
+    playground_id: str,
+    limit: int = Query(settings.MESSAGE_PAGE_SIZE, ge=1, le=settings.MESSAGE_PAGE_MAX),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since: Optional[datetime] = None,
+    user_id: str = Depends(get_current_user_id),
+):
+    """
+    Cursor-paginated history. Without parameters, the latest page; pass the
+    returned `before` cursor to load older messages, and `after` (or a `since`
+    timestamp) to poll for new ones.
+    """
+    await require_member(playground_id, user_id)
+    try:
+        return await page_messages(playground_id, limit=limit, before=before, after=after, since=since)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
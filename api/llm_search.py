@@ -2,7 +2,9 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Optional
 from api.users import get_current_user
-from services.llm_search_service import run_search
+from core.sse import stream_answer
+from core.workers import WorkerPoolSaturated
+from services.llm_search_service import lookup_cached, run_search, stream_search
 from services.subject_service import get_subject, append_llm_search_to_subject
 
 router = APIRouter(prefix="/llm-search", tags=["llm-search"])
@@ -11,31 +13,80 @@ router = APIRouter(prefix="/llm-search", tags=["llm-search"])
 class LLMSearchIn(BaseModel):
     query: str
     subject_id: Optional[str] = None
+    # skip the semantic answer cache and always run a fresh search
+    bypass_cache: bool = False
 
 
 class LLMSearchOut(BaseModel):
     result: str
+    partial: Optional[bool] = None
+    cached: Optional[bool] = None
     saved: Optional[bool] = None
     subject_id: Optional[str] = None
 
 
 @router.post("/", response_model=LLMSearchOut)
-async def llm_search_endpoint(payload: LLMSearchIn):
+async def llm_search_endpoint(payload: LLMSearchIn, current_user: dict = Depends(get_current_user)):
+    # answers are cached per playground when the search belongs to a subject
+    subj = None
+    if payload.subject_id:
+        subj = await get_subject(payload.subject_id)
+        if not subj:
+            raise HTTPException(status_code=404, detail="Subject not found")
+    scope = subj["playground_id"] if subj else None
+
     try:
-        result = run_search(payload.query)
+        search = await run_search(payload.query, scope=scope, bypass_cache=payload.bypass_cache)
+    except WorkerPoolSaturated:
+        raise  # 503 with Retry-After, see main.py
     except RuntimeError as re:
         raise HTTPException(status_code=500, detail=str(re))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {e}")
+    result = search["answer"]
 
+    if payload.subject_id:
+        try:
+            await append_llm_search_to_subject(payload.subject_id, payload.query, result, added_by=current_user.get("_id"))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to save conversation: {e}")
+        return LLMSearchOut(result=result, partial=search["partial"], cached=search.get("cached", False), saved=True, subject_id=payload.subject_id)
+
+    return LLMSearchOut(result=result, partial=search["partial"], cached=search.get("cached", False), saved=False, subject_id=None)
+
+
+@router.post("/stream")
+async def llm_search_stream_endpoint(payload: LLMSearchIn, current_user: dict = Depends(get_current_user)):
+    """
+    Server-Sent Events variant of POST /llm-search/: `step` events for each search
+    round, `token` events for the answer, then a `done` event with the save status.
+    """
+    subj = None
     if payload.subject_id:
         subj = await get_subject(payload.subject_id)
         if not subj:
             raise HTTPException(status_code=404, detail="Subject not found")
+    scope = subj["playground_id"] if subj else None
+
+    # embed the query before the stream starts, so a full io pool is still a 503
+    try:
+        lookup = await lookup_cached(payload.query, scope=scope, bypass_cache=payload.bypass_cache)
+    except WorkerPoolSaturated:
+        raise  # 503 with Retry-After, see main.py
+    except RuntimeError as re:
+        raise HTTPException(status_code=500, detail=str(re))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {e}")
+
+    async def on_complete(result: str) -> dict:
+        if not payload.subject_id:
+            return {"saved": False, "subject_id": None}
         try:
             await append_llm_search_to_subject(payload.subject_id, payload.query, result, added_by=current_user.get("_id"))
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to save conversation: {e}")
-        return LLMSearchOut(result=result, saved=True, subject_id=payload.subject_id)
+            return {"saved": False, "subject_id": payload.subject_id, "detail": f"Failed to save conversation: {e}"}
+        return {"saved": True, "subject_id": payload.subject_id}
 
-    return LLMSearchOut(result=result, saved=False, subject_id=None)
+    return stream_answer(
+        stream_search(payload.query, scope=scope, bypass_cache=payload.bypass_cache, lookup=lookup), on_complete
+    )
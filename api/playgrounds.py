@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Path
-from api.users import get_current_user
+from api.users import get_current_user, get_current_user_id
 from services.playground_service import (
     create_playground, get_playground, add_member_by_userid, 
-    is_member, delete_playground, list_user_playgrounds,
+    get_access, delete_playground, list_user_playgrounds,
     remove_member_by_userid
 )
 from services.subject_service import list_subjects
@@ -12,6 +12,20 @@ from bson.objectid import ObjectId
 
 router = APIRouter(prefix="/playgrounds", tags=["playgrounds"])
 
+
+async def require_member(playground_id: str, user_id: str, detail: str = "Not a member") -> dict:
+    """
+    Authorize a playground-scoped request: 404 if the playground doesn't exist,
+    403 with `detail` if the user isn't a member. Returns the {owner, members} access info.
+    """
+    access = await get_access(playground_id)
+    if not access:
+        raise HTTPException(status_code=404, detail="Playground not found")
+    if user_id not in access["members"]:
+        raise HTTPException(status_code=403, detail=detail)
+    return access
+
+
 @router.post("/", response_model=PlaygroundOut)
 async def create_pg(payload: PlaygroundCreate, current_user: dict = Depends(get_current_user)):
     pg = await create_playground(payload.name, current_user["_id"])
@@ -26,44 +40,38 @@ async def create_pg(payload: PlaygroundCreate, current_user: dict = Depends(get_
     }
 
 @router.get("/{playground_id}", response_model=PlaygroundOut)
-async def get_pg(playground_id: str = Path(...), current_user: dict = Depends(get_current_user)):
+async def get_pg(playground_id: str = Path(...), user_id: str = Depends(get_current_user_id)):
+    await require_member(playground_id, user_id, "Not a member of this playground")
     pg = await get_playground(playground_id)
     if not pg:
         raise HTTPException(status_code=404, detail="Playground not found")
-    if current_user["_id"] not in pg["members"]:
-        raise HTTPException(status_code=403, detail="Not a member of this playground")
     return pg
 
 @router.get("/", response_model=list[PlaygroundOut])
-async def list_my_playgrounds(current_user: dict = Depends(get_current_user)):
+async def list_my_playgrounds(user_id: str = Depends(get_current_user_id)):
     """Get all playgrounds where the current user is a member"""
-    playgrounds = await list_user_playgrounds(current_user["_id"])
+    playgrounds = await list_user_playgrounds(user_id)
     return playgrounds
 
 @router.post("/{playground_id}/invite")
-async def invite(playground_id: str, payload: InviteIn, current_user: dict = Depends(get_current_user)):
+async def invite(playground_id: str, payload: InviteIn, user_id: str = Depends(get_current_user_id)):
     # Only owner or members can invite
-    pg = await get_playground(playground_id)
-    if not pg:
-        raise HTTPException(status_code=404, detail="Playground not found")
-    # check inviter is member
-    if current_user["_id"] not in pg["members"]:
-        raise HTTPException(status_code=403, detail="Not allowed to invite")
+    await require_member(playground_id, user_id, "Not allowed to invite")
     # find user by username
     db = get_db()
-    user = await db.users.find_one({"username": payload.username})
+    user = await db.users.find_one({"username": payload.username}, {"_id": 1})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    user_id = str(user["_id"])
-    await add_member_by_userid(playground_id, user_id)
-    return {"message": "user invited (and added) to playground", "user_id": user_id}
+    invited_id = str(user["_id"])
+    await add_member_by_userid(playground_id, invited_id)
+    return {"message": "user invited (and added) to playground", "user_id": invited_id}
 
 @router.delete("/{playground_id}")
-async def delete(playground_id: str, current_user: dict = Depends(get_current_user)):
-    pg = await get_playground(playground_id)
-    if not pg:
+async def delete(playground_id: str, user_id: str = Depends(get_current_user_id)):
+    access = await get_access(playground_id)
+    if not access:
         raise HTTPException(status_code=404, detail="Playground not found")
-    if current_user["_id"] != pg["owner"]:
+    if user_id != access["owner"]:
         raise HTTPException(status_code=403, detail="Only owner may delete playground")
     await delete_playground(playground_id)
     return {"message": "playground deleted"}
@@ -71,18 +79,14 @@ async def delete(playground_id: str, current_user: dict = Depends(get_current_us
 @router.post("/{playground_id}/leave")
 async def leave_playground(
     playground_id: str,
-    current_user: dict = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
-    pg = await get_playground(playground_id)
-    if not pg:
-        raise HTTPException(status_code=404, detail="Playground not found")
-    if current_user["_id"] not in pg["members"]:
-        raise HTTPException(status_code=403, detail="You are not a member of this playground")
-    if current_user["_id"] == pg["owner"]:
+    access = await require_member(playground_id, user_id, "You are not a member of this playground")
+    if user_id == access["owner"]:
         raise HTTPException(
             status_code=400,
             detail="Owner cannot leave. Transfer ownership or delete the playground instead."
         )
 
-    await remove_member_by_userid(playground_id, current_user["_id"])
+    await remove_member_by_userid(playground_id, user_id)
     return {"message": "Left playground successfully"}
\ No newline at end of file
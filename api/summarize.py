@@ -2,7 +2,9 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, HttpUrl
 from typing import Optional
 from api.users import get_current_user
-from services.summarize_service import summarize_youtube
+from core.sse import stream_answer
+from core.workers import WorkerPoolSaturated
+from services.summarize_service import prepare_content, summarize_youtube, stream_summarize_youtube
 from services.subject_service import get_subject, append_youtube_summarize_to_subject
 
 router = APIRouter(prefix="/summarize", tags=["summarize"])
@@ -20,10 +22,16 @@ class SummarizeOut(BaseModel):
 
 
 @router.post("/", response_model=SummarizeOut)
-async def summarize_endpoint(payload: SummarizeIn):
+async def summarize_endpoint(payload: SummarizeIn, current_user: dict = Depends(get_current_user)):
+    # check the subject before spending a summary on a request that can't be saved
+    if payload.subject_id and not await get_subject(payload.subject_id):
+        raise HTTPException(status_code=404, detail="Subject not found")
+
     # generate summary (will raise clear errors if deps or key missing)
     try:
         summary = await summarize_youtube(str(payload.youtube_link))
+    except WorkerPoolSaturated:
+        raise  # 503 with Retry-After, see main.py
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except RuntimeError as re:
@@ -31,12 +39,8 @@ async def summarize_endpoint(payload: SummarizeIn):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to summarize: {e}")
 
-    # if subject_id provided, validate subject exists and append
+    # if subject_id provided, attach summary to subject
     if payload.subject_id:
-        subj = await get_subject(payload.subject_id)
-        if not subj:
-            raise HTTPException(status_code=404, detail="Subject not found")
-        # attach summary to subject
         try:
             await append_youtube_summarize_to_subject(payload.subject_id, str(payload.youtube_link), summary, added_by=current_user.get("_id"))
         except Exception as e:
@@ -44,3 +48,34 @@ async def summarize_endpoint(payload: SummarizeIn):
         return SummarizeOut(summary=summary, saved=True, subject_id=payload.subject_id)
 
     return SummarizeOut(summary=summary, saved=False, subject_id=None)
+
+
+@router.post("/stream")
+async def summarize_stream_endpoint(payload: SummarizeIn, current_user: dict = Depends(get_current_user)):
+    """Server-Sent Events variant of POST /summarize/: `token` events, then a `done` event with the save status."""
+    if payload.subject_id and not await get_subject(payload.subject_id):
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+    url = str(payload.youtube_link)
+    # fetch before the stream starts, so a full fetch pool or a bad URL is still a proper status code
+    try:
+        text = await prepare_content(url)
+    except WorkerPoolSaturated:
+        raise  # 503 with Retry-After, see main.py
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except RuntimeError as re:
+        raise HTTPException(status_code=500, detail=str(re))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to summarize: {e}")
+
+    async def on_complete(summary: str) -> dict:
+        if not payload.subject_id:
+            return {"saved": False, "subject_id": None}
+        try:
+            await append_youtube_summarize_to_subject(payload.subject_id, url, summary, added_by=current_user.get("_id"))
+        except Exception as e:
+            return {"saved": False, "subject_id": payload.subject_id, "detail": f"Failed to save summary: {e}"}
+        return {"saved": True, "subject_id": payload.subject_id}
+
+    return stream_answer(stream_summarize_youtube(url, text), on_complete)
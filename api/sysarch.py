@@ -1,12 +1,33 @@
-from fastapi import APIRouter, HTTPException
-from services.system_arch_service import extract_json, validate_flowchart, assign_levels
-from models.sysarch import PromptRequest, FlowResponse
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from services.system_arch_service import (
+    check_graph, recover_flowchart, record_generation, FlowchartStreamParser,
+    apply_patch, compact_flowchart, parse_json, repair_json, record_refinement,
+)
+from services import architecture_cache_service, flowchart_service
+from models.sysarch import PromptRequest, FlowResponse, RefineRequest, RefineResponse
+from api.users import get_current_user
+from core.sse import SSE_HEADERS, sse_event
+from core.workers import WorkerPoolSaturated
+import asyncio
+import hashlib
 import json
-from groq import Groq
+import logging
+import groq
+from core import llm_gateway
+from core.singleflight import SingleFlight
 from core.config import settings
 
 router = APIRouter(tags=["sysarch"])
-client = Groq(api_key=settings.GROQ_API_KEY)
+logger = logging.getLogger(__name__)
+
+# identical prompts arriving together share one generation
+_GENERATIONS = SingleFlight("sysarch")
+
+# caps simultaneous 8000-token generations so they can't monopolise the Groq pool
+_GENERATION_SLOTS = asyncio.Semaphore(settings.SYSARCH_MAX_CONCURRENCY)
 
 
 EXAMPLE_JSON = """
@@ -95,60 +116,345 @@ Now generate the flowchart JSON for this request. Output ONLY the JSON object, n
 {prompt}"""
 
 
+@asynccontextmanager
+async def _generation_slot():
+    """Hold one of the SYSARCH_MAX_CONCURRENCY generation slots, or fail with 503 after the queue timeout."""
+    try:
+        await asyncio.wait_for(_GENERATION_SLOTS.acquire(), timeout=settings.SYSARCH_QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many architecture generations in progress",
+            headers={"Retry-After": str(int(settings.SYSARCH_QUEUE_TIMEOUT_SECONDS))},
+        )
+    try:
+        yield
+    finally:
+        _GENERATION_SLOTS.release()
+
+
+def _completion_kwargs(prompt: str) -> dict:
+    return dict(
+        model=settings.SYSARCH_MODEL_NAME,
+        caller="sysarch",
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user",   "content": build_user_message(prompt)},
+        ],
+        temperature=0.2,   # matches Node.js version exactly
+        max_tokens=8000,   # matches Node.js version exactly
+        # NOTE: no response_format here — the Node.js version didn't
+        # use JSON mode either, relying on the prompt + extractJson instead
+    )
+
+
+# any change to the prompts changes the cache key, so stale diagrams aren't served
+PROMPT_VERSION = hashlib.sha256((SYSTEM_PROMPT + build_user_message("")).encode("utf-8")).hexdigest()[:12]
+
+
+def _cache_key(prompt: str) -> str:
+    return architecture_cache_service.cache_key(prompt, settings.SYSARCH_MODEL_NAME, PROMPT_VERSION)
+
+
+async def _complete(prompt: str):
+    """Run the completion through the LLM gateway, waiting for a free generation slot."""
+    async with _generation_slot():
+        return await llm_gateway.chat(**_completion_kwargs(prompt))
+
+
+CONTINUE_PROMPT = (
+    "Your previous reply was cut off before the JSON was complete. Continue it exactly "
+    "from the last character you wrote. Output only the remaining JSON text, without "
+    "repeating anything and without markdown fences."
+)
+
+
+async def _continue(prompt: str, partial: str) -> tuple[str, int]:
+    """Ask the model to finish a cut-off flowchart. Returns (continuation text, completion tokens)."""
+    kwargs = _completion_kwargs(prompt)
+    kwargs["messages"] += [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+    kwargs["max_tokens"] = settings.SYSARCH_CONTINUATION_MAX_TOKENS
+    async with _generation_slot():
+        completion = await llm_gateway.chat(**kwargs)
+    text = (completion.choices[0].message.content or "").strip().removeprefix("```json").removeprefix("```")
+    usage = getattr(completion, "usage", None)
+    return text, getattr(usage, "completion_tokens", 0) or 0
+
+
+async def _build_flowchart(prompt: str, raw: str, truncated: bool) -> dict:
+    """
+    Parse and repair the model output; if it was cut off and repair couldn't
+    recover it (or recovered nodes but no edges), spend one continuation call
+    instead of failing the whole generation.
+    """
+    flowchart, outcome, dropped_nodes, dropped_edges = recover_flowchart(raw)
+    needs_more = flowchart is None or (truncated and not flowchart["edges"] and len(flowchart["nodes"]) > 1)
+    if needs_more and truncated and settings.SYSARCH_CONTINUATION_ENABLED:
+        continuation, tokens = await _continue(prompt, raw)
+        # the model sometimes restarts the object instead of continuing it
+        for candidate in (raw + continuation, continuation):
+            continued, _, cont_nodes, cont_edges = recover_flowchart(candidate)
+            if continued is not None and (flowchart is None or len(continued["edges"]) > len(flowchart["edges"])):
+                record_generation("continued", cont_nodes, cont_edges, tokens)
+                return continued
+        if flowchart is None:
+            record_generation("failed", continuation_tokens=tokens)
+            raise HTTPException(status_code=502, detail="Model output was not valid JSON")
+        record_generation(outcome, dropped_nodes, dropped_edges, tokens)
+        return flowchart
+
+    record_generation(outcome, dropped_nodes, dropped_edges)
+    if flowchart is None:
+        raise HTTPException(
+            status_code=502,
+            detail="Generated JSON does not match required flowchart schema "
+                   "(nodes with id, label; edges with from, to)",
+        )
+    return flowchart
+
+
+async def _generate(prompt: str, key: str) -> tuple[dict, dict]:
+    """One model generation, parsed, repaired, levelled and cached under `key`. Returns (flowchart, issues)."""
+    completion = await _complete(prompt)
+
+    raw = completion.choices[0].message.content
+    if not raw or not raw.strip():
+        raise HTTPException(status_code=502, detail="Empty response from model")
+
+    raw = raw.strip()
+
+    # Parse, repairing truncation/syntax slips and dropping dangling nodes/edges
+    truncated = completion.choices[0].finish_reason == "length"
+    parsed = await _build_flowchart(prompt, raw, truncated)
+
+    # Ensure every node has a level (BFS fallback if model omitted them) and look for cycles/orphans
+    issues = check_graph(parsed)
+    await architecture_cache_service.store(key, parsed)
+    return parsed, issues
+
+
 @router.post("/generate-architecture", response_model=FlowResponse)
-async def generate_architecture(body: PromptRequest):
+async def generate_architecture(body: PromptRequest, current_user: dict = Depends(get_current_user)):
     if not body.prompt.strip():
         raise HTTPException(status_code=400, detail="Missing or empty prompt")
 
+    key = _cache_key(body.prompt)
+    cached = await architecture_cache_service.lookup(key, force_refresh=body.force_refresh)
+    if cached is not None:
+        # a fresh stored copy, so refining it doesn't touch anyone else's diagram
+        issues = check_graph(cached)
+        return {**await _store(body.prompt, cached, current_user["_id"]), "cached": True, "issues": issues}
+
+    try:
+        parsed, issues = await _GENERATIONS.do(key, lambda: _generate(body.prompt, key))
+        return {**await _store(body.prompt, parsed, current_user["_id"]), "issues": issues}
+
+    except HTTPException:
+        raise
+    except WorkerPoolSaturated:
+        raise  # 503 with Retry-After, see main.py
+    except groq.APITimeoutError:
+        raise HTTPException(status_code=504, detail="Architecture generation timed out")
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=str(e) if str(e) else "Generation failed"
+        )
+
+
+async def _store(prompt: str, flowchart: dict, owner_id: str) -> dict:
+    """Save a generated flowchart so its owner can refine it; a storage failure doesn't cost the user the generation."""
+    try:
+        return await flowchart_service.save_flowchart(prompt, flowchart, owner_id)
+    except Exception:
+        logger.exception("Could not store generated flowchart")
+        return flowchart
+
+
+async def _architecture_events(prompt: str, owner_id: str, force_refresh: bool = False):
+    key = _cache_key(prompt)
+    cached = await architecture_cache_service.lookup(key, force_refresh=force_refresh)
+    if cached is not None:
+        issues = check_graph(cached)
+        for node in cached["nodes"]:
+            yield sse_event("node", node)
+        for edge in cached["edges"]:
+            yield sse_event("edge", edge)
+        saved = await _store(prompt, cached, owner_id)
+        yield sse_event("done", {
+            "id": saved.get("id"),
+            "version": saved.get("version"),
+            "levels": {},
+            "nodes": len(cached["nodes"]),
+            "edges": len(cached["edges"]),
+            "dropped": 0,
+            "cached": True,
+            "issues": issues,
+        })
+        return
+
+    parser = FlowchartStreamParser()
+    raw = []
     try:
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
+        async with _generation_slot():
+            async for chunk in llm_gateway.stream_chat(**_completion_kwargs(prompt)):
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if not text:
+                    continue
+                raw.append(text)
+                for kind, obj in parser.feed(text):
+                    yield sse_event(kind, obj)
+    except HTTPException as e:
+        yield sse_event("error", {"detail": e.detail, "status_code": e.status_code})
+        return
+    except WorkerPoolSaturated as e:
+        yield sse_event("error", {"detail": str(e), "status_code": 503, "retry_after": e.retry_after})
+        return
+    except groq.APITimeoutError:
+        yield sse_event("error", {"detail": "Architecture generation timed out", "status_code": 504})
+        return
+    except Exception as e:
+        yield sse_event("error", {"detail": str(e) or "Generation failed", "status_code": 500})
+        return
+
+    flowchart = parser.finish()
+    if not flowchart["nodes"]:
+        # nothing recognisable streamed out (e.g. unexpected key order); fall back to a full parse
+        flowchart, outcome, dropped_nodes, dropped_edges = recover_flowchart("".join(raw))
+        record_generation(outcome, dropped_nodes, dropped_edges)
+        if flowchart is None:
+            yield sse_event("error", {"detail": "Model output was not a valid flowchart", "status_code": 502})
+            return
+        for node in flowchart["nodes"]:
+            yield sse_event("node", node)
+        for edge in flowchart["edges"]:
+            yield sse_event("edge", edge)
+    else:
+        record_generation("repaired" if parser.rejected else "clean")
+
+    # check_graph recomputes every level when any is missing, so send the whole map in that case
+    recomputed = not all(isinstance(n.get("level"), int) for n in flowchart["nodes"])
+    issues = check_graph(flowchart)
+    await architecture_cache_service.store(key, flowchart)
+    flowchart = await _store(prompt, flowchart, owner_id)
+    yield sse_event("done", {
+        "id": flowchart.get("id"),
+        "version": flowchart.get("version"),
+        "levels": {n["id"]: n["level"] for n in flowchart["nodes"]} if recomputed else {},
+        "nodes": len(flowchart["nodes"]),
+        "edges": len(flowchart["edges"]),
+        "dropped": parser.rejected,
+        "cached": False,
+        "issues": issues,
+    })
+
+
+@router.post("/generate-architecture/stream")
+async def generate_architecture_stream(body: PromptRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Server-Sent Events version of /generate-architecture: `node` and `edge` events
+    as soon as each object is complete in the model output (edges only once both
+    endpoints have been sent), then a `done` event whose `levels` map carries
+    BFS-computed levels when the model left any node without one, and whose
+    `issues` lists the cycles and orphan nodes found in the graph.
+    """
+    if not body.prompt.strip():
+        raise HTTPException(status_code=400, detail="Missing or empty prompt")
+    return StreamingResponse(_architecture_events(body.prompt, current_user["_id"], body.force_refresh), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+REFINE_SYSTEM_PROMPT = """You edit an existing system architecture flowchart. You are given its nodes (id | label | level) and edges (from -> to) and an edit instruction.
+Reply with ONLY a JSON patch object describing the smallest change that carries out the instruction, using any of these keys:
+- "add_nodes": new nodes, each with "id" (unique snake_case), "label", "level", "details" and "steps" (4-8 actionable steps, no framework or tool names)
+- "update_nodes": objects with the "id" of an existing node plus only the fields that change
+- "remove_nodes": ids of nodes to delete (their edges are removed automatically)
+- "add_edges": objects with "from" and "to" node ids
+- "remove_edges": objects with "from" and "to" of edges to delete
+Never repeat unchanged nodes or edges. Every edge must connect existing or newly added nodes, and no node may be left disconnected."""
+
+
+async def _patch_for(flowchart: dict, instruction: str) -> tuple[dict, int]:
+    """Ask the model for a patch implementing `instruction`. Returns (patch, completion tokens)."""
+    async with _generation_slot():
+        completion = await llm_gateway.chat(
+            model=settings.SYSARCH_MODEL_NAME,
+            caller="sysarch_refine",
+            priority=llm_gateway.INTERACTIVE,
             messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user",   "content": build_user_message(body.prompt)},
+                {"role": "system", "content": REFINE_SYSTEM_PROMPT},
+                {"role": "user", "content": f"{compact_flowchart(flowchart)}\n\nInstruction: {instruction}"},
             ],
-            temperature=0.2,   # matches Node.js version exactly
-            max_tokens=8000,   # matches Node.js version exactly
-            # NOTE: no response_format here — the Node.js version didn't
-            # use JSON mode either, relying on the prompt + extractJson instead
+            temperature=0.2,
+            max_tokens=settings.SYSARCH_REFINE_MAX_TOKENS,
         )
+    raw = completion.choices[0].message.content or ""
+    try:
+        patch = parse_json(raw)
+    except ValueError:
+        try:
+            patch = json.loads(repair_json(raw))
+        except ValueError:
+            raise HTTPException(status_code=502, detail="Model did not return a valid patch")
+    usage = getattr(completion, "usage", None)
+    return patch, getattr(usage, "completion_tokens", 0) or 0
 
-        raw = completion.choices[0].message.content
-        if not raw or not raw.strip():
-            raise HTTPException(status_code=502, detail="Empty response from model")
 
-        raw = raw.strip()
+@router.get("/architectures/{flowchart_id}", response_model=FlowResponse)
+async def get_architecture(flowchart_id: str, version: Optional[int] = None, current_user: dict = Depends(get_current_user)):
+    flowchart = await flowchart_service.get_flowchart(flowchart_id, current_user["_id"], version)
+    if not flowchart:
+        raise HTTPException(status_code=404, detail="Flowchart not found")
+    return flowchart
 
-        # Extract and parse JSON
-        try:
-            json_str = extract_json(raw)
-            parsed = json.loads(json_str)
-        except (ValueError, json.JSONDecodeError) as e:
-            raise HTTPException(
-                status_code=502,
-                detail="Model output was not valid JSON"
-            )
 
-        # Validate structure
-        if not validate_flowchart(parsed):
-            raise HTTPException(
-                status_code=502,
-                detail="Generated JSON does not match required flowchart schema "
-                       "(nodes with id, label; edges with from, to)",
-            )
+@router.get("/architectures/{flowchart_id}/versions")
+async def get_architecture_versions(flowchart_id: str, current_user: dict = Depends(get_current_user)):
+    versions = await flowchart_service.list_versions(flowchart_id, current_user["_id"])
+    if not versions:
+        raise HTTPException(status_code=404, detail="Flowchart not found")
+    return versions
 
-        # Ensure every node has a level (BFS fallback if model omitted them)
-        parsed = assign_levels(parsed)
 
-        return parsed
+@router.post("/architectures/{flowchart_id}/refine", response_model=RefineResponse)
+async def refine_architecture(flowchart_id: str, body: RefineRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Edit a stored flowchart: the model sees only node ids/labels/levels and the
+    edges, returns a patch, and the patched diagram is validated and stored as
+    the next version.
+    """
+    if not body.instruction.strip():
+        raise HTTPException(status_code=400, detail="Missing or empty instruction")
+    flowchart = await flowchart_service.get_flowchart(flowchart_id, current_user["_id"], body.version)
+    if not flowchart:
+        raise HTTPException(status_code=404, detail="Flowchart not found")
+
+    try:
+        patch, tokens = await _patch_for(flowchart, body.instruction)
+        record_refinement(tokens)
+        try:
+            refined = apply_patch(flowchart, patch)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        issues = check_graph(refined)
+        try:
+            saved = await flowchart_service.save_version(
+                flowchart_id, current_user["_id"], flowchart["version"], refined, body.instruction, patch
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return {**saved, "patch": patch, "issues": issues}
 
     except HTTPException:
         raise
+    except WorkerPoolSaturated:
+        raise  # 503 with Retry-After, see main.py
+    except groq.APITimeoutError:
+        raise HTTPException(status_code=504, detail="Architecture refinement timed out")
     except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=str(e) if str(e) else "Generation failed"
-        )
+        raise HTTPException(status_code=500, detail=str(e) or "Refinement failed")
 
 
 @router.get("/health")
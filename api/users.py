@@ -1,9 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, Response
+from fastapi.responses import RedirectResponse
 from core.config import settings
 from db.mongodb import get_db
-from core.security import bytes_to_base64
-from services import auth_service
-from bson.binary import Binary
+from services import auth_service, avatar_service
 from bson.objectid import ObjectId
 from typing import Optional
 from jose import jwt
@@ -20,7 +19,8 @@ def get_token_from_cookie(request: Request):
         raise HTTPException(status_code=401, detail="Not authenticated")
     return token
 
-async def get_current_user(request: Request):
+async def get_current_user_id(request: Request) -> str:
+    """Id of the authenticated user, from the JWT alone, for handlers that need nothing else."""
     token = get_token_from_cookie(request)
     try:
         payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
@@ -30,39 +30,38 @@ async def get_current_user(request: Request):
         raise HTTPException(status_code=401, detail="Invalid token")
 
     user_id = payload.get("user_id")
-
-    
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token payload")
+    return user_id
 
-    user = await USERS().find_one({"_id": ObjectId(user_id)})
+async def get_current_user(request: Request):
+    """
+    The authenticated user as {_id, username, email, avatar_id}, from the principal
+    cache. `avatar_id` is the uploaded avatar's digest, missing or None for predefined
+    and legacy avatars; update_me and the avatar routes rely on it. The predefined
+    avatar URL and password hash are not loaded; /users/me fetches the avatar itself.
+    """
+    user_id = await get_current_user_id(request)
+    user = await auth_service.get_principal(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    return user
 
-    # convert id
-    user["_id"] = str(user["_id"])
-
-    # handle avatar (can be bytes or URL)
-    avatar = user.get("avatar")
-
-    if isinstance(avatar, (bytes, Binary)):
-        # if stored as BSON Binary, convert to bytes first if needed
-        avatar_bytes = avatar if isinstance(avatar, bytes) else bytes(avatar)
-        user["avatar"] = bytes_to_base64(avatar_bytes)
-    elif isinstance(avatar, str):
-        # predefined avatar URL
-        user["avatar"] = avatar
-    else:
-        user["avatar"] = None
-    
 
+def _user_out(user: dict) -> dict:
+    user["_id"] = str(user["_id"])
+    # uploaded avatars become a URL to /users/{id}/avatar, predefined ones stay as they are
+    user["avatar"] = avatar_service.avatar_url(user)
+    user.pop("avatar_id", None)
     return user
 
 
 @router.get("/me")
 async def get_me(current_user=Depends(get_current_user)):
-    # returns the user object prepared in dependency
-    return current_user
+    user = await USERS().find_one({"_id": ObjectId(current_user["_id"])}, {"password": 0, "password_reset": 0})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return _user_out(user)
 
 @router.put("/me")
 async def update_me(
@@ -74,6 +73,7 @@ async def update_me(
     current_user=Depends(get_current_user)
 ):
     update = {}
+    unset = {}
     if username and username != current_user["username"]:
         # ensure uniqueness
         existing = await USERS().find_one({"username": username})
@@ -87,29 +87,29 @@ async def update_me(
         update["email"] = email
     if avatar:
         # User uploaded a file
-        avatar_bytes = await avatar.read()
-        update["avatar"] = Binary(avatar_bytes)
+        try:
+            update["avatar_id"] = await avatar_service.store_avatar(await avatar_service.read_upload(avatar))
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
+        unset["avatar"] = ""
     elif avatar_url:
         # User selected a predefined avatar URL
         update["avatar"] = avatar_url
+        unset["avatar_id"] = ""
     
     if not update:
         raise HTTPException(status_code=400, detail="Nothing to update")
     
-    await USERS().update_one({"_id": ObjectId(current_user["_id"])}, {"$set": update})
-    user = await USERS().find_one({"_id": ObjectId(current_user["_id"])})
-    user["_id"] = str(user["_id"])
-    
-    # Handle avatar response
-    avatar = user.get("avatar")
-    if isinstance(avatar, bytes):
-        user["avatar"] = bytes_to_base64(avatar)
-    elif isinstance(avatar, str):
-        user["avatar"] = avatar
-    else:
-        user["avatar"] = None
-    
-    return user
+    changes = {"$set": update}
+    if unset:
+        changes["$unset"] = unset
+    await USERS().update_one({"_id": ObjectId(current_user["_id"])}, changes)
+    auth_service.invalidate_principal(current_user["_id"])
+    old_avatar_id = current_user.get("avatar_id")
+    if (avatar or avatar_url) and old_avatar_id and old_avatar_id != update.get("avatar_id"):
+        await avatar_service.release_avatar(old_avatar_id)
+    user = await USERS().find_one({"_id": ObjectId(current_user["_id"])}, {"password": 0, "password_reset": 0})
+    return _user_out(user)
 
 @router.post("/change-password")
 async def change_password(body: dict, current_user=Depends(get_current_user)):
@@ -121,3 +121,39 @@ async def change_password(body: dict, current_user=Depends(get_current_user)):
     if not ok:
         raise HTTPException(status_code=400, detail="Old password incorrect")
     return {"message": "Password changed successfully"}
+
+@router.get("/{user_id}/avatar")
+async def get_avatar(user_id: str, request: Request, size: Optional[int] = None, v: Optional[str] = None):
+    """
+    A user's avatar as a square thumbnail (the nearest stored size at least
+    `size` pixels wide). Public, so <img> tags work cross-origin. Responses
+    carry a content-hash ETag; URLs with the `v` version that API responses
+    include are cacheable for good, others for AVATAR_MAX_AGE_SECONDS.
+    """
+    principal = await auth_service.get_principal(user_id)
+    if not principal:
+        raise HTTPException(status_code=404, detail="User not found")
+    digest = principal.get("avatar_id")
+    if not digest:
+        # predefined avatars are URLs; embedded legacy avatars are only served inline until migrated
+        user = await USERS().find_one({"_id": ObjectId(user_id)}, {"avatar": 1})
+        if user and isinstance(user.get("avatar"), str):
+            return RedirectResponse(user["avatar"])
+        raise HTTPException(status_code=404, detail="No avatar")
+
+    size = avatar_service.pick_size(size)
+    etag = f'"{digest}-{size}"'
+    # a stale or shortened version must not pin an old avatar for a year
+    if v == avatar_service.version(digest):
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        cache_control = f"public, max-age={settings.AVATAR_MAX_AGE_SECONDS}"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    thumbnail = await avatar_service.get_thumbnail(digest, size)
+    if not thumbnail:
+        raise HTTPException(status_code=404, detail="No avatar")
+    data, content_type = thumbnail
+    return Response(content=data, media_type=content_type, headers=headers)
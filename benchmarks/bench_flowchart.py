@@ -0,0 +1,130 @@
+"""
+Micro-benchmark for the flowchart pipeline in services/system_arch_service.py
+on synthetic model output with 50 to 5,000 nodes.
+
+    python -m benchmarks.bench_flowchart [--repeat N]
+
+Each stage is timed on the same input and reported as the best of N runs in
+milliseconds. The `legacy_*` rows are the previous regex extraction and
+list-based BFS, kept here as the baseline. `stream_parse` feeds the text in
+16-character pieces, roughly what the Groq stream delivers per chunk.
+"""
+import argparse
+import json
+import random
+import re
+import time
+
+from services import flowchart_graph
+from services.system_arch_service import FlowchartStreamParser, assign_levels, extract_json, parse_json, validate_flowchart
+
+SIZES = (50, 500, 2000, 5000)
+
+
+def synthetic_flowchart(n: int, seed: int = 0) -> dict:
+    """A layered DAG with a few retry loops, shaped like real model output."""
+    rng = random.Random(seed)
+    nodes = [
+        {
+            "id": f"node_{i}",
+            "label": f"Step {i}",
+            "details": "Handles {request} parsing and \"quoted\" values " * 3,
+            "steps": [f"Do part {k} of step {i}" for k in range(5)],
+        }
+        for i in range(n)
+    ]
+    edges = [{"from": f"node_{rng.randrange(i)}", "to": f"node_{i}"} for i in range(1, n)]
+    edges += [{"from": f"node_{i}", "to": f"node_{rng.randrange(i)}"} for i in rng.sample(range(1, n), n // 20)]
+    return {"nodes": nodes, "edges": edges}
+
+
+def model_output(flowchart: dict) -> str:
+    return "Here is the architecture you asked for:\n```json\n" + json.dumps(flowchart, indent=2) + "\n```\n"
+
+
+def legacy_extract_json(text: str) -> str:
+    cleaned = re.sub(r"```(?:json)?", "", text).strip().strip("`").strip()
+    if cleaned.startswith("{"):
+        return cleaned
+    match = re.search(r"\{.*\}", cleaned, re.DOTALL)
+    if match:
+        return match.group()
+    raise ValueError("No valid JSON object found in model response")
+
+
+def legacy_parse_json(text: str):
+    return json.loads(legacy_extract_json(text))
+
+
+def legacy_assign_levels(data: dict) -> dict:
+    node_ids = [n["id"] for n in data["nodes"]]
+    adj = {nid: [] for nid in node_ids}
+    for edge in data["edges"]:
+        if edge["from"] in adj:
+            adj[edge["from"]].append(edge["to"])
+    levels = {node_ids[0]: 0}
+    queue = [node_ids[0]]
+    while queue:
+        current = queue.pop(0)
+        for neighbor in adj.get(current, []):
+            if neighbor not in levels:
+                levels[neighbor] = levels[current] + 1
+                queue.append(neighbor)
+    for node in data["nodes"]:
+        node["level"] = levels.get(node["id"], 0)
+    return data
+
+
+def stream_parse(text: str, chunk: int = 16):
+    parser = FlowchartStreamParser()
+    for i in range(0, len(text), chunk):
+        parser.feed(text[i:i + chunk])
+    return parser.finish()
+
+
+def best_of(repeat: int, fn, make_arg) -> float:
+    timings = []
+    for _ in range(repeat):
+        arg = make_arg()
+        start = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def run(repeat: int):
+    print(f"{'stage':<22}" + "".join(f"{n:>12}" for n in SIZES))
+    rows: dict[str, list[float]] = {}
+    for n in SIZES:
+        flowchart = synthetic_flowchart(n)
+        text = model_output(flowchart)
+        parsed = json.loads(extract_json(text))
+        assert json.loads(legacy_extract_json(text)) == parsed
+        assert validate_flowchart(parsed)
+
+        def unlevelled():
+            return {"nodes": [dict(node) for node in flowchart["nodes"]], "edges": flowchart["edges"]}
+
+        stages = {
+            "extract_json": (extract_json, lambda: text),
+            "legacy_extract_json": (legacy_extract_json, lambda: text),
+            "json.loads": (json.loads, lambda: extract_json(text)),
+            "parse_json": (parse_json, lambda: text),
+            "legacy_parse_json": (legacy_parse_json, lambda: text),
+            "validate_flowchart": (validate_flowchart, lambda: parsed),
+            "analyze": (flowchart_graph.analyze, lambda: parsed),
+            "assign_levels": (assign_levels, unlevelled),
+            "legacy_assign_levels": (legacy_assign_levels, unlevelled),
+            "stream_parse": (stream_parse, lambda: text),
+        }
+        for name, (fn, make_arg) in stages.items():
+            rows.setdefault(name, []).append(best_of(repeat, fn, make_arg))
+
+    for name, timings in rows.items():
+        print(f"{name:<22}" + "".join(f"{ms:>10.2f}ms" for ms in timings))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    run(parser.parse_args().repeat)
@@ -0,0 +1,96 @@
+"""
+Login-storm benchmark against a running server: fires concurrent POST
+/auth/login requests while probing a cheap endpoint, to show whether bcrypt
+work blocks unrelated requests.
+
+    python -m benchmarks.bench_login_storm [--base-url URL] [--concurrency N] [--requests N]
+
+The benchmark user is registered first if it doesn't exist. Reported: login
+throughput, login latency p50/p99, and p50/p99 of /health/workers measured
+during the storm. With hashing on the event loop the probe latency tracks the
+login latency; with the hash pool it should stay in the low milliseconds. The
+final pool stats show how long logins queued for a hashing thread.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+def percentile(samples: list[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000
+
+
+async def ensure_user(client: httpx.AsyncClient, username: str, password: str):
+    res = await client.post("/auth/login", json={"username": username, "password": password})
+    if res.status_code == 200:
+        return
+    res = await client.post("/auth/register", data={
+        "username": username,
+        "email": f"{username}@example.com",
+        "password": password,
+        "avatar_url": "https://example.com/avatar.png",
+    })
+    res.raise_for_status()
+
+
+async def login_storm(client: httpx.AsyncClient, args) -> dict:
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    remaining = iter(range(args.requests))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            res = await client.post("/auth/login", json={"username": args.username, "password": args.password})
+            latencies.append(time.perf_counter() - start)
+            statuses[res.status_code] = statuses.get(res.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return {"elapsed": time.perf_counter() - start, "latencies": latencies, "statuses": statuses}
+
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, interval: float) -> list[float]:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/health/workers")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client:
+        await ensure_user(client, args.username, args.password)
+        stop = asyncio.Event()
+        prober = asyncio.create_task(probe(client, stop, args.probe_interval))
+        storm = await login_storm(client, args)
+        stop.set()
+        probes = await prober
+        pools = (await client.get("/health/workers")).json()
+
+    logins = storm["latencies"]
+    print(f"logins           {len(logins)} in {storm['elapsed']:.2f}s ({len(logins) / storm['elapsed']:.1f} req/s)")
+    print(f"status codes     {storm['statuses']}")
+    print(f"login latency    p50 {percentile(logins, 50):.1f}ms  p99 {percentile(logins, 99):.1f}ms")
+    print(f"probe latency    p50 {percentile(probes, 50):.1f}ms  p99 {percentile(probes, 99):.1f}ms  ({len(probes)} probes)")
+    if "password_hash" in pools:
+        print(f"hash pool        {pools['password_hash']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", default="bench_login_user")
+    parser.add_argument("--password", default="bench-login-password")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,170 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional
+
+from db.mongodb import get_db
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Small in-process LRU cache with an optional per-entry time-to-live.
+    Thread-safe so it can be shared between the event loop and worker threads.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None, on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data: OrderedDict = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, expires_at: Optional[float]) -> bool:
+        return expires_at is not None and expires_at < time.monotonic()
+
+    def _evict(self, key, value):
+        self.evictions += 1
+        if self.on_evict:
+            try:
+                self.on_evict(key, value)
+            except Exception:
+                pass
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if self._expired(expires_at):
+                del self._data[key]
+                self._evict(key, value)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """Like get(), but without touching recency or the hit/miss counters."""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or self._expired(item[1]):
+                return default
+            return item[0]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                old_key, (old_value, _) = self._data.popitem(last=False)
+                self._evict(old_key, old_value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        if item is _MISSING:
+            return default
+        return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def values(self) -> list:
+        with self._lock:
+            return [v for v, exp in self._data.values() if not self._expired(exp)]
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            return item is not _MISSING and not self._expired(item[1])
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class TieredCache:
+    """
+    TTLCache in front of a Mongo collection, for results worth sharing between
+    workers and keeping across restarts. Documents look like
+    {_id: key, value, created_at}; the collection should carry a TTL index on
+    `created_at` (see db.mongodb.connect_db), and stale documents are also
+    ignored on read since the TTL monitor only runs once a minute.
+    """
+
+    def __init__(self, collection: str, maxsize: int, ttl_seconds: float, persist: bool = True):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        # persist=False keeps the cache purely in-process
+        self.persist = persist
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self.db_hits = 0
+        self.db_misses = 0
+
+    def _collection(self):
+        return get_db()[self.collection]
+
+    async def get(self, key: str, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if not self.persist:
+            return default
+        doc = await self._collection().find_one({"_id": key})
+        fresh_after = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        if not doc or doc.get("created_at") is None or doc["created_at"] < fresh_after:
+            self.db_misses += 1
+            return default
+        self.db_hits += 1
+        self.memory.set(key, doc["value"])
+        return doc["value"]
+
+    async def set(self, key: str, value):
+        self.memory.set(key, value)
+        if not self.persist:
+            return
+        await self._collection().replace_one(
+            {"_id": key},
+            {"_id": key, "value": value, "created_at": datetime.utcnow()},
+            upsert=True,
+        )
+
+    async def delete(self, key: str):
+        self.memory.pop(key)
+        if self.persist:
+            await self._collection().delete_one({"_id": key})
+
+    def stats(self) -> dict:
+        hits = self.memory.hits + self.db_hits
+        misses = self.db_misses if self.persist else self.memory.misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "memory": self.memory.stats(),
+            "db_hits": self.db_hits,
+            "db_misses": self.db_misses,
+        }
@@ -11,7 +11,117 @@ class Settings(BaseSettings):
     PASSWORD_RESET_EXP_MINUTES: int = 30
     GROQ_API_KEY: str
     GROQ_MODEL_NAME: str = "llama-3.1-8b-instant"
+    SEARCH_MODEL_NAME: str = "llama-3.1-8b-instant"
+    SYSARCH_MODEL_NAME: str = "llama-3.3-70b-versatile"
+    # shared async Groq HTTP pool
+    GROQ_HTTP_MAX_CONNECTIONS: int = 20
+    GROQ_HTTP_MAX_KEEPALIVE: int = 10
+    GROQ_TIMEOUT_SECONDS: float = 120
+    # core.llm_gateway: per-model quotas. The gateway ships Groq's published limits for the models
+    # above; entries here override them (e.g. {"llama-3.3-70b-versatile": {"rpm": 1000, "tpm": 300000}})
+    # and GROQ_RPM/GROQ_TPM cover any other model
+    GROQ_RPM: int = 30
+    GROQ_TPM: int = 12000
+    GROQ_MODEL_LIMITS: dict[str, dict[str, int]] = {}
+    LLM_MAX_CONCURRENCY: int = 16
+    LLM_MAX_RETRIES: int = 4
+    LLM_BACKOFF_BASE_SECONDS: float = 1.0
+    LLM_BACKOFF_MAX_SECONDS: float = 30.0
+    # completion tokens reserved up front (at most max_tokens); the real usage is charged when the response arrives
+    LLM_RESERVE_COMPLETION_TOKENS: int = 512
+    # a call that can't get quota within this long fails with 503 + Retry-After instead of queueing on
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 30
     HF_TOKEN: str | None = None
+    # persistent PDF vector index (chat-pdf)
+    PDF_INDEX_DIR: str = "data/pdf_index"
+    PDF_INDEX_MAX_DOCUMENTS: int = 200
+    PDF_INDEX_MAX_BYTES: int = 2 * 1024 * 1024 * 1024
+    PDF_INDEX_TTL_HOURS: int = 24 * 7
+    PDF_INDEX_OPEN_HANDLES: int = 16
+    # ingestion worker pools (core/workers.py)
+    INGEST_PROCESS_WORKERS: int = 2
+    INGEST_THREAD_WORKERS: int = 4
+    INGEST_QUEUE_DEPTH: int = 16
+    INGEST_RETRY_AFTER_SECONDS: int = 10
+    EMBED_BATCH_SIZE: int = 64
+    # network fetches (transcripts, web pages) wait on remote servers, so they get their own
+    # threads instead of competing with embedding and Chroma for the ingest pool
+    FETCH_THREAD_WORKERS: int = 8
+    FETCH_QUEUE_DEPTH: int = 32
+    # bcrypt: cost factor (hashes with another cost are upgraded on the next login) and its thread pool
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE_DEPTH: int = 64
+    PASSWORD_HASH_RETRY_AFTER_SECONDS: int = 2
+    # authenticated-user cache behind get_current_user; the TTL bounds staleness across workers
+    PRINCIPAL_CACHE_SIZE: int = 4096
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60
+    # uploaded avatars (services/avatar_service.py); AVATAR_BASE_URL prefixes the
+    # /users/{id}/avatar URLs in responses when the frontend is on another origin
+    AVATAR_SIZES: list[int] = [64, 128, 256]
+    AVATAR_DEFAULT_SIZE: int = 128
+    AVATAR_FORMAT: str = "WEBP"
+    AVATAR_MAX_BYTES: int = 5 * 1024 * 1024
+    AVATAR_MAX_PIXELS: int = 40_000_000
+    AVATAR_CACHE_SIZE: int = 512
+    AVATAR_MAX_AGE_SECONDS: int = 3600
+    AVATAR_BASE_URL: str = ""
+    # playground owner/member sets used for authorization; local invalidation, TTL bounds other workers
+    PLAYGROUND_ACCESS_CACHE_SIZE: int = 2048
+    PLAYGROUND_ACCESS_CACHE_TTL_SECONDS: int = 30
+    # playground message history pages
+    MESSAGE_PAGE_SIZE: int = 50
+    MESSAGE_PAGE_MAX: int = 200
+    # streamed PDF uploads
+    UPLOAD_SPOOL_DIR: str = "data/uploads"
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    PDF_MAX_UPLOAD_BYTES: int = 50 * 1024 * 1024
+    # the other form fields of a PDF upload (message, ids), on top of the file
+    UPLOAD_FORM_MAX_BYTES: int = 1024 * 1024
+    # PDF chat session history
+    CHAT_HISTORY_MAX_TURNS: int = 20
+    CHAT_HISTORY_CACHE_SIZE: int = 1000
+    CHAT_HISTORY_CACHE_TTL_SECONDS: int = 300
+    CHAT_HISTORY_TTL_DAYS: int = 30
+    # "llm" rephrases follow-ups with an extra Groq call, "heuristic" does it locally;
+    # sessions with fewer history messages than the minimum skip rephrasing entirely
+    PDF_CHAT_REPHRASE_MODE: str = "llm"
+    PDF_CHAT_REPHRASE_MIN_MESSAGES: int = 2
+    # /summarize transcript and summary caches
+    CONTENT_CACHE_SIZE: int = 256
+    CONTENT_CACHE_TTL_HOURS: int = 24 * 7
+    SUMMARY_CACHE_TTL_HOURS: int = 24 * 30
+    # map-reduce summarization for content longer than a single prompt
+    SUMMARIZE_LONG_MODE: bool = True
+    SUMMARIZE_SINGLE_PASS_CHARS: int = 12000
+    SUMMARIZE_CHUNK_TOKENS: int = 3000
+    SUMMARIZE_CHUNK_OVERLAP_TOKENS: int = 100
+    SUMMARIZE_MAP_CONCURRENCY: int = 4
+    # /llm-search engine budget
+    SEARCH_DEADLINE_SECONDS: float = 20
+    SEARCH_MAX_STEPS: int = 3
+    SEARCH_OBSERVATION_CHARS: int = 1500
+    # search tool result cache (set PERSIST to False for in-process only)
+    SEARCH_TOOL_CACHE_SIZE: int = 1024
+    SEARCH_TOOL_CACHE_TTL_HOURS: int = 24
+    SEARCH_TOOL_CACHE_PERSIST: bool = True
+    # semantic answer cache for llm-search and chat-pdf (cosine similarity on MiniLM embeddings)
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 512
+    SEMANTIC_CACHE_MAX_SCOPES: int = 256
+    SEMANTIC_CACHE_TTL_SECONDS: int = 24 * 3600
+    # /generate-architecture
+    SYSARCH_MAX_CONCURRENCY: int = 4
+    SYSARCH_QUEUE_TIMEOUT_SECONDS: float = 30
+    # one "continue the JSON" completion when local repair can't save a cut-off generation
+    SYSARCH_CONTINUATION_ENABLED: bool = True
+    SYSARCH_CONTINUATION_MAX_TOKENS: int = 4000
+    # output budget for a refinement patch (a full generation gets 8000)
+    SYSARCH_REFINE_MAX_TOKENS: int = 2000
+    # validated flowcharts keyed by normalized prompt + model + prompt version
+    ARCH_CACHE_SIZE: int = 256
+    ARCH_CACHE_TTL_HOURS: int = 24 * 7
 
     class Config:
         env_file = ".env"
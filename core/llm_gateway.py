@@ -0,0 +1,369 @@
+"""
+Single entry point for Groq chat completions. Every caller shares the pooled
+client from the registry and, per model, a token-bucket limiter sized to the
+Groq requests/tokens-per-minute quotas; callers waiting for quota are served by
+priority, and one that can't be served within LLM_QUEUE_TIMEOUT_SECONDS gets
+QuotaExhausted (a 503 with Retry-After). A call reserves its prompt plus a
+small completion budget and is charged its real usage once the response says
+what it was. 429, 5xx and connection failures are retried with jittered
+exponential backoff, and a Retry-After from Groq pauses every caller of that
+model rather than just the one that hit it.
+"""
+import asyncio
+import hashlib
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Optional
+
+import groq
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+from core import registry
+from core.config import settings
+from core.workers import WorkerPoolSaturated
+
+# priorities: lower is served first when callers are queued for quota
+INTERACTIVE = 0
+DEFAULT = 1
+BACKGROUND = 2
+
+# Groq's published per-model quotas; settings.GROQ_MODEL_LIMITS overrides them
+_MODEL_LIMITS = {
+    "llama-3.1-8b-instant": {"rpm": 30, "tpm": 6000},
+    "llama-3.3-70b-versatile": {"rpm": 30, "tpm": 12000},
+}
+
+_RETRYABLE = (groq.RateLimitError, groq.InternalServerError, groq.APIConnectionError)
+_ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+_SEQ = itertools.count()
+_SLOTS = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+_LIMITERS: dict[tuple, "_Limiter"] = {}
+_STATS = defaultdict(lambda: {
+    "requests": 0, "retries": 0, "rate_limited": 0, "errors": 0, "rejected": 0, "wait_seconds": 0.0, "tokens": 0,
+})
+# the loop the pooled client and limiters are used from; sync calls are scheduled onto it
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+
+class QuotaExhausted(WorkerPoolSaturated):
+    """A model's quota won't free up within LLM_QUEUE_TIMEOUT_SECONDS; answered like a full worker pool."""
+
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"llm:{model}", max(1, math.ceil(retry_after)))
+        self.args = (f"{model} quota is used up, retry in {self.retry_after}s",)
+
+
+class _Limiter:
+    """Request and token buckets for one model, refilled continuously; queued callers go by priority."""
+
+    def __init__(self, model: str, rpm: int, tpm: int):
+        self.model = model
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiters: list = []  # heap of [priority, seq, wake-up event]
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def _delay(self, tokens: int, now: float) -> float:
+        self._refill(now)
+        return max(
+            0.0,
+            self.paused_until - now,
+            (1 - self.requests) * 60 / self.rpm,
+            (tokens - self.tokens) * 60 / self.tpm,
+        )
+
+    async def acquire(self, tokens: int, priority: int, timeout: float) -> float:
+        """
+        Wait until a request of `tokens` fits in both buckets. Returns the seconds waited.
+        Raises QuotaExhausted as soon as it's clear that won't happen within `timeout`.
+        """
+        # a reservation bigger than the whole bucket would never fit; let it through when the bucket is full
+        tokens = min(tokens, self.tpm)
+        started = time.monotonic()
+        deadline = started + timeout
+        entry = [priority, next(_SEQ), asyncio.Event()]
+        heapq.heappush(self._waiters, entry)
+        try:
+            while True:
+                if self._waiters[0] is not entry:
+                    try:
+                        await asyncio.wait_for(entry[2].wait(), timeout=max(deadline - time.monotonic(), 0))
+                    except asyncio.TimeoutError:
+                        raise QuotaExhausted(self.model, self._delay(tokens, time.monotonic()))
+                    entry[2].clear()
+                    continue
+                now = time.monotonic()
+                delay = self._delay(tokens, now)
+                if delay <= 0:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return now - started
+                if now + delay > deadline:
+                    raise QuotaExhausted(self.model, delay)
+                try:
+                    await asyncio.wait_for(entry[2].wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                entry[2].clear()
+        finally:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            if self._waiters:
+                self._waiters[0][2].set()
+
+    def refund(self, tokens: int):
+        """
+        Give back (or, if negative, charge) the difference between reserved and actual
+        tokens. Charging can leave the bucket below zero; later callers wait it out.
+        """
+        self.tokens = min(self.tpm, self.tokens + tokens)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        self._refill(time.monotonic())
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "requests_available": round(self.requests, 2),
+            "tokens_available": round(self.tokens),
+            "waiting": len(self._waiters),
+            "paused_seconds": round(max(self.paused_until - time.monotonic(), 0.0), 2),
+        }
+
+
+def _key_id(api_key: Optional[str]) -> str:
+    if not api_key or api_key == settings.GROQ_API_KEY:
+        return "default"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def _limiter(model: str, api_key: Optional[str]) -> _Limiter:
+    key = (model, _key_id(api_key))
+    limiter = _LIMITERS.get(key)
+    if limiter is None:
+        limits = {**_MODEL_LIMITS.get(model, {}), **settings.GROQ_MODEL_LIMITS.get(model, {})}
+        limiter = _Limiter(model, limits.get("rpm", settings.GROQ_RPM), limits.get("tpm", settings.GROQ_TPM))
+        _LIMITERS[key] = limiter
+    return limiter
+
+
+def _estimate_tokens(messages: list[dict], max_tokens: Optional[int]) -> int:
+    # ~4 characters per token for the prompt, plus a typical completion rather than the
+    # whole max_tokens budget: the real total is charged when the response arrives
+    prompt_chars = sum(len(str(m.get("content", ""))) for m in messages)
+    completion = settings.LLM_RESERVE_COMPLETION_TOKENS
+    return prompt_chars // 4 + (min(max_tokens, completion) if max_tokens else completion)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _retry_delay(error: Exception, attempt: int, limiter: _Limiter, counters: dict) -> float:
+    """Seconds to wait before retrying `error`; re-raises when it isn't worth retrying."""
+    if isinstance(error, groq.APITimeoutError) or attempt >= settings.LLM_MAX_RETRIES:
+        counters["errors"] += 1
+        raise error
+    counters["retries"] += 1
+    if isinstance(error, groq.RateLimitError):
+        counters["rate_limited"] += 1
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        # the quota is shared, so hold back every caller of this model, not just this one
+        limiter.pause(retry_after)
+        return retry_after + random.uniform(0, settings.LLM_BACKOFF_BASE_SECONDS)
+    return random.uniform(0, min(settings.LLM_BACKOFF_MAX_SECONDS, settings.LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+async def _acquire(limiter: _Limiter, tokens: int, priority: int, counters: dict):
+    try:
+        counters["wait_seconds"] += await limiter.acquire(tokens, priority, settings.LLM_QUEUE_TIMEOUT_SECONDS)
+    except QuotaExhausted:
+        counters["rejected"] += 1
+        raise
+
+
+async def chat(messages: list[dict], *, model: Optional[str] = None, caller: str = "default",
+               priority: int = DEFAULT, api_key: Optional[str] = None, **params):
+    """
+    chat.completions.create() through the shared limiter and retry policy.
+    `caller` names the feature for /health/llm; `params` go to the Groq SDK.
+    """
+    model = model or settings.GROQ_MODEL_NAME
+    counters = _STATS[caller]
+    counters["requests"] += 1
+    limiter = _limiter(model, api_key)
+    client = registry.get_async_groq(api_key)
+    reserved = _estimate_tokens(messages, params.get("max_tokens"))
+
+    for attempt in range(settings.LLM_MAX_RETRIES + 1):
+        await _acquire(limiter, reserved, priority, counters)
+        try:
+            async with _SLOTS:
+                completion = await client.chat.completions.create(model=model, messages=messages, **params)
+        except _RETRYABLE as e:
+            await asyncio.sleep(_retry_delay(e, attempt, limiter, counters))
+            continue
+        except Exception:
+            counters["errors"] += 1
+            raise
+        used = getattr(getattr(completion, "usage", None), "total_tokens", None)
+        if used:
+            limiter.refund(reserved - used)
+            counters["tokens"] += used
+        return completion
+
+
+async def stream_chat(messages: list[dict], *, model: Optional[str] = None, caller: str = "default",
+                      priority: int = DEFAULT, api_key: Optional[str] = None, **params):
+    """
+    Streaming variant of chat(), yielding the SDK's chunks. Only failures before
+    the first chunk are retried; a stream that breaks midway raises.
+    """
+    model = model or settings.GROQ_MODEL_NAME
+    counters = _STATS[caller]
+    counters["requests"] += 1
+    limiter = _limiter(model, api_key)
+    client = registry.get_async_groq(api_key)
+    reserved = _estimate_tokens(messages, params.get("max_tokens"))
+
+    for attempt in range(settings.LLM_MAX_RETRIES + 1):
+        await _acquire(limiter, reserved, priority, counters)
+        async with _SLOTS:
+            try:
+                stream = await client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+            except _RETRYABLE as e:
+                delay = _retry_delay(e, attempt, limiter, counters)
+            except Exception:
+                counters["errors"] += 1
+                raise
+            else:
+                used = None
+                async for chunk in stream:
+                    # Groq reports usage on the last chunk
+                    usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+                    used = getattr(usage, "total_tokens", None) or used
+                    yield chunk
+                if used:
+                    limiter.refund(reserved - used)
+                    counters["tokens"] += used
+                return
+        await asyncio.sleep(delay)
+
+
+def _to_dicts(messages: list[BaseMessage]) -> list[dict]:
+    return [{"role": _ROLES.get(m.type, "user"), "content": m.content} for m in messages]
+
+
+class GatewayChatModel(BaseChatModel):
+    """LangChain chat model whose calls go through the gateway, for the chains in services/."""
+
+    model_name: str
+    caller: str = "default"
+    priority: int = DEFAULT
+    api_key: Optional[str] = Field(default=None, repr=False)
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "groq-gateway"
+
+    def _params(self, stop: Optional[list[str]]) -> dict:
+        params: dict[str, Any] = {"model": self.model_name, "caller": self.caller, "priority": self.priority, "api_key": self.api_key}
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        if self.max_tokens is not None:
+            params["max_tokens"] = self.max_tokens
+        if stop:
+            params["stop"] = stop
+        return params
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        completion = await chat(_to_dicts(messages), **self._params(stop))
+        content = completion.choices[0].message.content or ""
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))], llm_output={"model_name": self.model_name})
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async for chunk in stream_chat(_to_dicts(messages), **self._params(stop)):
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if not text:
+                continue
+            generation = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=generation)
+            yield generation
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        """Sync invoke()/batch(): run _agenerate on the gateway's loop and wait for it."""
+        loop = _gateway_loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            # blocking here would deadlock the loop the call has to run on
+            raise RuntimeError("Use ainvoke/astream on gateway models from async code")
+        return asyncio.run_coroutine_threadsafe(self._agenerate(messages, stop=stop), loop).result()
+
+
+def chat_model(model_name: Optional[str] = None, caller: str = "default", priority: int = DEFAULT,
+               api_key: Optional[str] = None) -> GatewayChatModel:
+    """Shared LangChain model for a (model, caller) pair; a caller-supplied API key gets its own instance."""
+    model = model_name or settings.GROQ_MODEL_NAME
+    if _key_id(api_key) != "default":
+        return GatewayChatModel(model_name=model, caller=caller, priority=priority, api_key=api_key)
+    return registry.get(
+        f"llm:{model}:{caller}",
+        lambda: GatewayChatModel(model_name=model, caller=caller, priority=priority),
+    )
+
+
+def attach(loop: asyncio.AbstractEventLoop):
+    """Use the app's event loop for sync LangChain calls made from worker threads."""
+    global _LOOP
+    _LOOP = loop
+
+
+def _gateway_loop() -> asyncio.AbstractEventLoop:
+    """The attached app loop, or (scripts, no app running) a private one on a daemon thread."""
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None or _LOOP.is_closed():
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name="llm-gateway", daemon=True).start()
+        return _LOOP
+
+
+def stats() -> dict:
+    return {
+        "in_flight": settings.LLM_MAX_CONCURRENCY - _SLOTS._value,
+        "callers": {name: {**c, "wait_seconds": round(c["wait_seconds"], 3)} for name, c in _STATS.items()},
+        "limits": {f"{model}:{key}": limiter.stats() for (model, key), limiter in _LIMITERS.items()},
+    }
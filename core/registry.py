@@ -0,0 +1,128 @@
+"""
+Process-wide registry for heavy, reusable objects (embedding model, LLM clients,
+search tools). Everything is created once, on first use or during the startup
+warm-up, and shared by all requests handled by this worker.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable
+
+import httpx
+from groq import AsyncGroq
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+_LOCK = threading.RLock()
+_INSTANCES: dict[str, Any] = {}
+_STATS: dict[str, dict] = {}
+
+
+def _rss_bytes() -> int:
+    """Current resident set size of this process (Linux), 0 if unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return 0
+
+
+def _param_bytes(obj: Any) -> int | None:
+    """Size of a torch module's parameters, if the object wraps one."""
+    module = getattr(obj, "_client", None) or getattr(obj, "client", None) or obj
+    params = getattr(module, "parameters", None)
+    if not callable(params):
+        return None
+    try:
+        return sum(p.numel() * p.element_size() for p in params())
+    except Exception:
+        return None
+
+
+def get(name: str, factory: Callable[[], Any]) -> Any:
+    """Return the shared instance registered under `name`, creating it with `factory` on first use."""
+    instance = _INSTANCES.get(name)
+    if instance is not None:
+        return instance
+    with _LOCK:
+        if name in _INSTANCES:
+            return _INSTANCES[name]
+        rss_before = _rss_bytes()
+        started = time.perf_counter()
+        instance = factory()
+        load_seconds = time.perf_counter() - started
+        _INSTANCES[name] = instance
+        _STATS[name] = {
+            "type": type(instance).__name__,
+            "load_seconds": round(load_seconds, 4),
+            "rss_delta_bytes": max(_rss_bytes() - rss_before, 0),
+            "param_bytes": _param_bytes(instance),
+            "loaded_at": time.time(),
+        }
+        logger.info("registry: loaded %s in %.2fs", name, load_seconds)
+        return instance
+
+
+def get_embeddings():
+    """Shared sentence-transformers embedding model."""
+    def factory():
+        if settings.HF_TOKEN:
+            os.environ["HF_TOKEN"] = settings.HF_TOKEN
+        return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    return get("embeddings", factory)
+
+
+def get_groq_http() -> httpx.AsyncClient:
+    """One keep-alive HTTP connection pool shared by every Groq client."""
+    def factory():
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.GROQ_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GROQ_HTTP_MAX_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(settings.GROQ_TIMEOUT_SECONDS, connect=10.0),
+        )
+    return get("groq_http", factory)
+
+
+def get_async_groq(api_key: str | None = None) -> AsyncGroq:
+    """
+    Shared async Groq SDK client (one per API key) over the shared pool.
+    SDK retries are off: core.llm_gateway owns retry and backoff.
+    """
+    key = api_key or settings.GROQ_API_KEY
+    name = "groq_async" if key == settings.GROQ_API_KEY else f"groq_async:{hashlib.sha256(key.encode()).hexdigest()[:12]}"
+
+    def factory():
+        return AsyncGroq(api_key=key, http_client=get_groq_http(), timeout=settings.GROQ_TIMEOUT_SECONDS, max_retries=0)
+    return get(name, factory)
+
+
+async def aclose():
+    """Close the pooled async HTTP client (called from the shutdown event)."""
+    http_client = _INSTANCES.get("groq_http")
+    if http_client is not None:
+        await http_client.aclose()
+
+
+def warm_up():
+    """Load the embedding model and the Groq client, and run one embedding so first requests are fast."""
+    embeddings = get_embeddings()
+    started = time.perf_counter()
+    embeddings.embed_query("warm up")
+    _STATS["embeddings"]["warmup_seconds"] = round(time.perf_counter() - started, 4)
+    get_async_groq()
+
+
+def stats() -> dict:
+    return {
+        "rss_bytes": _rss_bytes(),
+        "instances": {name: dict(s) for name, s in _STATS.items()},
+    }
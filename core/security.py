@@ -1,15 +1,30 @@
 from datetime import datetime, timedelta
 from jose import jwt
 from core.config import settings
+from core.workers import hash_pool
 import base64
 import bcrypt
 
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password[:72].encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    return bcrypt.hashpw(password[:72].encode("utf-8"), bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)).decode("utf-8")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password[:72].encode("utf-8"), hashed_password.encode("utf-8"))
 
+def needs_rehash(hashed_password: str) -> bool:
+    """True when a bcrypt hash ("$2b$<cost>$...") was made with a cost other than BCRYPT_ROUNDS."""
+    try:
+        return int(hashed_password.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+# bcrypt takes ~250 ms at cost 12; these run it on the bounded hash pool instead of the event loop
+async def hash_password_async(password: str) -> str:
+    return await hash_pool.run(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hash_pool.run(verify_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_minutes: int = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=(expires_minutes or settings.JWT_EXP_MINUTES))
@@ -0,0 +1,50 @@
+"""
+Single-flight coalescing: concurrent calls for the same key share one in-flight
+computation instead of each doing the work (e.g. dozens of students summarizing
+the same shared YouTube link at once).
+"""
+import asyncio
+from typing import Any, Awaitable, Callable
+
+_GROUPS: dict[str, "SingleFlight"] = {}
+
+
+class SingleFlight:
+    """
+    do(key, fn) runs fn() unless a call with the same key is already running,
+    in which case it awaits that call's result (or exception) instead. The
+    computation runs as its own task, so a caller that disconnects doesn't
+    cancel it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[str, asyncio.Task] = {}
+        self.counters = {"calls": 0, "executed": 0, "collapsed": 0}
+        _GROUPS[name] = self
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.counters["calls"] += 1
+        task = self._calls.get(key)
+        if task is not None:
+            self.counters["collapsed"] += 1
+        else:
+            self.counters["executed"] += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {**self.counters, "in_flight": len(self._calls)}
+
+
+def stats() -> dict:
+    return {name: group.stats() for name, group in _GROUPS.items()}
@@ -0,0 +1,51 @@
+import json
+from typing import AsyncIterator, Awaitable, Callable
+
+from fastapi.responses import StreamingResponse
+
+from core.workers import WorkerPoolSaturated
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # stop reverse proxies from buffering the stream
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def _answer_events(tokens: AsyncIterator, on_complete: Callable[[str], Awaitable[dict]]):
+    parts = []
+    try:
+        async for token in tokens:
+            if isinstance(token, dict):
+                # progress information (e.g. agent tool calls), not part of the answer
+                yield sse_event("step", token)
+            elif token:
+                parts.append(token)
+                yield sse_event("token", {"text": token})
+    except WorkerPoolSaturated as e:
+        # the 200 is already sent; pass on the Retry-After the app-level handler would have set
+        yield sse_event("error", {"detail": str(e), "status": 503, "retry_after": e.retry_after})
+        return
+    except Exception as e:
+        yield sse_event("error", {"detail": str(e) or "Generation failed"})
+        return
+    try:
+        done = await on_complete("".join(parts))
+    except Exception as e:
+        yield sse_event("error", {"detail": str(e)})
+        return
+    yield sse_event("done", done)
+
+
+def stream_answer(tokens: AsyncIterator, on_complete: Callable[[str], Awaitable[dict]]) -> StreamingResponse:
+    """
+    Stream `tokens` as `token` events, then await on_complete(full_answer) and send
+    its dict as the final `done` event. Dict items are sent as `step` events and
+    failures become an `error` event (with `retry_after` when a worker pool was full).
+    """
+    return StreamingResponse(_answer_events(tokens, on_complete), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,132 @@
+"""
+Bounded executors that keep CPU-heavy and blocking work off the event loop.
+
+`cpu_pool` is a process pool for pure-Python CPU work (PDF parsing/splitting),
+`io_pool` a thread pool for blocking local calls (embedding, Chroma, image
+resizing), `fetch_pool` a thread pool for blocking network fetches (transcripts,
+web pages) and `hash_pool` a thread pool for bcrypt, which releases the GIL.
+Each pool admits at most `workers + queue_depth` jobs; beyond that `run`
+raises WorkerPoolSaturated so the API can answer 503 with Retry-After instead
+of queueing unboundedly.
+"""
+import asyncio
+import functools
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from core.config import settings
+
+
+class WorkerPoolSaturated(Exception):
+    def __init__(self, pool: str, retry_after: int):
+        super().__init__(f"{pool} worker pool is busy, retry in {retry_after}s")
+        self.pool = pool
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, factory: Callable[[int], Executor], workers: int, queue_depth: int,
+                 retry_after: Optional[int] = None):
+        self.name = name
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after or settings.INGEST_RETRY_AFTER_SECONDS
+        self._factory = factory
+        self._executor: Optional[Executor] = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        # time jobs spent queued before a worker picked them up
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_depth
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self._factory(self.workers)
+        return self._executor
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise WorkerPoolSaturated(self.name, self.retry_after)
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(fn, *args, **kwargs)
+            # only thread-pool jobs can report back when they started
+            if isinstance(self._get_executor(), ThreadPoolExecutor):
+                call = functools.partial(self._timed, time.perf_counter(), call)
+            return await loop.run_in_executor(self._get_executor(), call)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def _timed(self, submitted: float, call: Callable):
+        waited = time.perf_counter() - submitted
+        self.queue_wait_total += waited
+        self.queue_wait_max = max(self.queue_wait_max, waited)
+        return call()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "pending": self.pending,
+            "running": min(self.pending, self.workers),
+            "queued": max(self.pending - self.workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_queue_wait_ms": round(self.queue_wait_total / self.completed * 1000, 2) if self.completed else 0.0,
+            "max_queue_wait_ms": round(self.queue_wait_max * 1000, 2),
+        }
+
+
+# spawn keeps worker processes from inheriting the torch/HTTP state of the server
+cpu_pool = BoundedExecutor(
+    "ingest_cpu",
+    lambda n: ProcessPoolExecutor(max_workers=n, mp_context=multiprocessing.get_context("spawn")),
+    settings.INGEST_PROCESS_WORKERS,
+    settings.INGEST_QUEUE_DEPTH,
+)
+io_pool = BoundedExecutor(
+    "ingest_io",
+    lambda n: ThreadPoolExecutor(max_workers=n, thread_name_prefix="ingest-io"),
+    settings.INGEST_THREAD_WORKERS,
+    settings.INGEST_QUEUE_DEPTH,
+)
+fetch_pool = BoundedExecutor(
+    "network_fetch",
+    lambda n: ThreadPoolExecutor(max_workers=n, thread_name_prefix="network-fetch"),
+    settings.FETCH_THREAD_WORKERS,
+    settings.FETCH_QUEUE_DEPTH,
+)
+
+hash_pool = BoundedExecutor(
+    "password_hash",
+    lambda n: ThreadPoolExecutor(max_workers=n, thread_name_prefix="password-hash"),
+    settings.PASSWORD_HASH_WORKERS,
+    settings.PASSWORD_HASH_QUEUE_DEPTH,
+    retry_after=settings.PASSWORD_HASH_RETRY_AFTER_SECONDS,
+)
+
+
+def shutdown():
+    cpu_pool.shutdown()
+    io_pool.shutdown()
+    fetch_pool.shutdown()
+    hash_pool.shutdown()
+
+
+def stats() -> dict:
+    return {pool.name: pool.stats() for pool in (cpu_pool, io_pool, fetch_pool, hash_pool)}
@@ -11,11 +11,27 @@ async def connect_db():
     # indexes
     await db.users.create_index("username", unique=True)
     await db.users.create_index("email", unique=True)
+    # uploaded avatars are shared by content hash; release_avatar checks for other references
+    await db.users.create_index("avatar_id", sparse=True)
     await db.playgrounds.create_index([("owner", 1)])
     await db.playgrounds.create_index([("members", 1)])
     await db.subjects.create_index([("playground_id", 1)])
-    # messages are stored at playground level now
-    await db.messages.create_index([("playground_id", 1), ("timestamp", 1)])
+    # messages are stored at playground level now; _id breaks timestamp ties so
+    # keyset pages over this index never skip or repeat a message
+    await db.messages.create_index([("playground_id", 1), ("timestamp", 1), ("_id", 1)])
+    # persisted PDF indexes, evicted least-recently-used first
+    await db.pdf_documents.create_index([("last_accessed_at", 1)])
+    # PDF chat histories expire after CHAT_HISTORY_TTL_DAYS of inactivity
+    await db.pdf_chat_sessions.create_index(
+        [("updated_at", 1)], expireAfterSeconds=settings.CHAT_HISTORY_TTL_DAYS * 24 * 3600
+    )
+    # /summarize caches
+    await db.content_cache.create_index([("created_at", 1)], expireAfterSeconds=settings.CONTENT_CACHE_TTL_HOURS * 3600)
+    await db.summary_cache.create_index([("created_at", 1)], expireAfterSeconds=settings.SUMMARY_CACHE_TTL_HOURS * 3600)
+    await db.search_tool_cache.create_index([("created_at", 1)], expireAfterSeconds=settings.SEARCH_TOOL_CACHE_TTL_HOURS * 3600)
+    # stored /generate-architecture flowcharts and their refinement history
+    await db.flowchart_versions.create_index([("flowchart_id", 1), ("version", 1)], unique=True)
+    await db.architecture_cache.create_index([("created_at", 1)], expireAfterSeconds=settings.ARCH_CACHE_TTL_HOURS * 3600)
 
 def get_db():
     if db is None:
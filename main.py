@@ -1,9 +1,19 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from core import llm_gateway, registry, singleflight, workers
 from db.mongodb import connect_db, close_db
+from services import (
+    auth_service, avatar_service, chat_history_service, content_cache_service, llm_search_service,
+    pdf_chat_service, playground_service, semantic_cache_service, system_arch_service, architecture_cache_service,
+)
 from api import auth, users
 from api import playgrounds, subjects, conversations, summarize, chat_pdf, llm_search, sysarch
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
 # CORS Configuration
@@ -20,13 +30,97 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(workers.WorkerPoolSaturated)
+async def worker_pool_saturated(request: Request, exc: workers.WorkerPoolSaturated):
+    """A full worker pool is back-pressure, not a failure: tell the client when to retry."""
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
 @app.on_event("startup")
 async def startup_event():
     await connect_db()
+    # sync LangChain calls from worker threads schedule their Groq calls on this loop
+    llm_gateway.attach(asyncio.get_running_loop())
+    # load the embedding model and LLM clients once, off the event loop
+    try:
+        await asyncio.to_thread(registry.warm_up)
+    except Exception:
+        logger.exception("Model warm-up failed; models will load on first use")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     await close_db()
+    await registry.aclose()
+    workers.shutdown()
+
+@app.get("/health/models")
+async def model_stats():
+    """Load time and memory footprint of the shared models and clients."""
+    return registry.stats()
+
+@app.get("/health/llm")
+async def llm_stats():
+    """Per-caller request/retry/429 counts, time spent waiting for quota, and limiter state per model."""
+    return llm_gateway.stats()
+
+@app.get("/health/singleflight")
+async def singleflight_stats():
+    """Per feature: calls, how many actually ran, and how many joined an identical in-flight call."""
+    return singleflight.stats()
+
+@app.get("/health/workers")
+async def worker_stats():
+    """Occupancy and queue wait of the ingestion and password-hashing worker pools."""
+    return workers.stats()
+
+@app.get("/health/auth-cache")
+async def auth_cache_stats():
+    """Hit rate of the authenticated-user cache behind get_current_user."""
+    return auth_service.principal_stats()
+
+@app.get("/health/avatars")
+async def avatar_stats():
+    """Hit rate of the in-memory avatar thumbnail cache."""
+    return avatar_service.stats()
+
+@app.get("/health/playground-access")
+async def playground_access_stats():
+    """Hit rate of the playground membership cache used for authorization."""
+    return playground_service.access_stats()
+
+@app.get("/health/chat-history")
+async def chat_history_stats():
+    """Hit rate and resident size of the PDF chat session cache."""
+    return chat_history_service.stats()
+
+@app.get("/health/chat-pdf")
+async def chat_pdf_stats():
+    """How often the history-aware rephrase step was skipped, done locally or done by the LLM."""
+    return pdf_chat_service.stats()
+
+@app.get("/health/summarize-cache")
+async def summarize_cache_stats():
+    """Hit/miss counters of the transcript and summary caches."""
+    return content_cache_service.stats()
+
+@app.get("/health/search-cache")
+async def search_cache_stats():
+    """Hit/miss counters of the search tool result cache."""
+    return llm_search_service.stats()
+
+@app.get("/health/semantic-cache")
+async def semantic_cache_stats():
+    """Hit rate and size of the semantic answer cache."""
+    return semantic_cache_service.stats()
+
+@app.get("/health/sysarch")
+async def sysarch_stats():
+    """How many architecture generations parsed cleanly, were repaired locally, needed a continuation or failed."""
+    return system_arch_service.stats()
+
+@app.get("/health/sysarch-cache")
+async def sysarch_cache_stats():
+    """Hit/miss counters of the generated-architecture cache."""
+    return architecture_cache_service.stats()
 
 app.include_router(auth.router)
 app.include_router(users.router)
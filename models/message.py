@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 class MessageCreate(BaseModel):
     content: str
@@ -12,3 +12,11 @@ class MessageOut(BaseModel):
     sender_username: Optional[str]
     content: str
     timestamp: datetime
+
+class MessagePage(BaseModel):
+    messages: List[MessageOut]
+    # opaque cursors: `before` fetches the next older page (None when there is none),
+    # `after` polls for messages newer than this page
+    before: Optional[str] = None
+    after: Optional[str] = None
+    has_more: bool
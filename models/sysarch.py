@@ -1,7 +1,15 @@
 from pydantic import BaseModel
+from typing import Optional
 
 class PromptRequest(BaseModel):
     prompt: str
+    # skip the architecture cache and generate a fresh diagram
+    force_refresh: bool = False
+
+class RefineRequest(BaseModel):
+    instruction: str
+    # version the instruction was written against; defaults to the latest
+    version: Optional[int] = None
 
 class NodeSchema(BaseModel):
     id: str
@@ -20,3 +28,12 @@ class EdgeSchema(BaseModel):
 class FlowResponse(BaseModel):
     nodes: list[dict]
     edges: list[dict]
+    # set once the flowchart has been stored, so it can be refined later
+    id: Optional[str] = None
+    version: Optional[int] = None
+    cached: bool = False
+    # {"cycles": [[node id, ...]], "orphans": [node id]} found in the graph; empty lists when clean
+    issues: Optional[dict] = None
+
+class RefineResponse(FlowResponse):
+    patch: dict
@@ -0,0 +1,55 @@
+"""
+Move avatars embedded in `users` documents as Binary into the avatar store
+(services/avatar_service.py) and point the users at it with `avatar_id`.
+
+    python -m scripts.migrate_avatars [--dry-run] [--limit N]
+
+Safe to re-run: only users whose `avatar` is still binary are selected, and
+each update is conditional on the avatar being unchanged, so a profile edit
+made meanwhile wins. Images that can't be decoded (or exceed AVATAR_MAX_BYTES)
+are reported and left embedded; they keep being served inline.
+"""
+import argparse
+import asyncio
+
+from core import workers
+from db.mongodb import close_db, connect_db, get_db
+from services import avatar_service
+
+
+async def migrate(dry_run: bool, limit: int):
+    await connect_db()
+    try:
+        users = get_db().users
+        cursor = users.find({"avatar": {"$type": "binData"}}, {"avatar": 1}).batch_size(50)
+        if limit:
+            cursor = cursor.limit(limit)
+        migrated = skipped = 0
+        async for user in cursor:
+            if dry_run:
+                print(f"would migrate {user['_id']} ({len(user['avatar'])} bytes)")
+                migrated += 1
+                continue
+            try:
+                avatar_id = await avatar_service.store_avatar(bytes(user["avatar"]))
+            except ValueError as e:
+                print(f"skipped {user['_id']}: {e}")
+                skipped += 1
+                continue
+            res = await users.update_one(
+                {"_id": user["_id"], "avatar": user["avatar"]},
+                {"$set": {"avatar_id": avatar_id}, "$unset": {"avatar": ""}},
+            )
+            migrated += res.modified_count
+        print(f"{'would migrate' if dry_run else 'migrated'} {migrated} avatars, skipped {skipped}")
+    finally:
+        workers.shutdown()
+        await close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--limit", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(migrate(args.dry_run, args.limit))
@@ -0,0 +1,45 @@
+"""
+Cache of validated /generate-architecture flowcharts keyed by normalized prompt
++ model + prompt version, so popular prompts ("e-commerce app", "URL
+shortener") don't each cost a 70B-model call.
+"""
+import copy
+import hashlib
+import re
+
+from core.cache import TieredCache
+from core.config import settings
+
+architecture_cache = TieredCache(
+    "architecture_cache",
+    maxsize=settings.ARCH_CACHE_SIZE,
+    ttl_seconds=settings.ARCH_CACHE_TTL_HOURS * 3600,
+)
+_COUNTERS = {"refreshed": 0}
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a prompt."""
+    return re.sub(r"\s+", " ", prompt).strip().rstrip(".!?").strip().lower()
+
+
+def cache_key(prompt: str, model_name: str, prompt_version: str) -> str:
+    prompt_hash = hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+    return f"{prompt_hash}:{prompt_version}:{model_name}"
+
+
+async def lookup(key: str, force_refresh: bool = False):
+    """The cached flowchart (a copy the caller may modify), or None on a miss or with force_refresh."""
+    if force_refresh:
+        _COUNTERS["refreshed"] += 1
+        return None
+    cached = await architecture_cache.get(key)
+    return copy.deepcopy(cached) if cached is not None else None
+
+
+async def store(key: str, flowchart: dict):
+    await architecture_cache.set(key, {"nodes": flowchart["nodes"], "edges": flowchart["edges"]})
+
+
+def stats() -> dict:
+    return {**architecture_cache.stats(), **_COUNTERS}
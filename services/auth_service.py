@@ -1,29 +1,32 @@
 from bson import ObjectId
-from bson.binary import Binary
+from bson.errors import InvalidId
 from datetime import datetime, timedelta, timezone
+from typing import Optional
 import secrets
-from core.security import hash_password, verify_password, create_access_token
+from core.cache import TTLCache
+from core.security import hash_password_async, verify_password_async, needs_rehash, create_access_token
 from core.config import settings
 from db.mongodb import get_db
 
+# Authenticated users as most handlers need them: no avatar blob, no password hash.
+# Invalidated on profile and password changes made by this worker; the TTL covers the others.
+_PRINCIPAL_FIELDS = {"username": 1, "email": 1, "avatar_id": 1}
+_PRINCIPALS = TTLCache(maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS)
+
 def USERS():
     return get_db().users
 
-async def create_user(username: str, email: str, password: str, avatar_bytes: bytes = None, avatar_url: str = None):
-    hashed = hash_password(password)
-    
-    # Store avatar as bytes (for uploads) or URL string (for predefined avatars)
-    avatar_value = None
-    if avatar_bytes:
-        avatar_value = Binary(avatar_bytes)
-    elif avatar_url:
-        avatar_value = avatar_url
+async def create_user(username: str, email: str, password: str, avatar_id: str = None, avatar_url: str = None):
+    hashed = await hash_password_async(password)
     
+    # Uploaded avatars live in the avatar store (services/avatar_service.py) and are referenced
+    # by avatar_id; predefined avatars are stored as their URL
     user = {
         "username": username,
         "email": email,
         "password": hashed,
-        "avatar": avatar_value,
+        "avatar": avatar_url if not avatar_id else None,
+        "avatar_id": avatar_id,
         "created_at": datetime.now(timezone.utc),
         "password_reset": None 
     }
@@ -47,23 +50,51 @@ async def verify_user_credentials(username: str, password: str):
     u = await find_user_by_username(username)
     if not u: 
         return None
-    if verify_password(password, u["password"]):
+    if await verify_password_async(password, u["password"]):
+        if needs_rehash(u["password"]):
+            # BCRYPT_ROUNDS changed since this hash was made; upgrade it while we have the plain password
+            rehashed = await hash_password_async(password)
+            await USERS().update_one({"_id": u["_id"], "password": u["password"]}, {"$set": {"password": rehashed}})
         u["_id"] = str(u["_id"])
         return u
     return None
 
+async def get_principal(user_id: str) -> Optional[dict]:
+    """{_id, username, email, avatar_id} for a user id, served from the principal cache. None if the user doesn't exist."""
+    cached = _PRINCIPALS.get(user_id)
+    if cached is not None:
+        return dict(cached)
+    try:
+        oid = ObjectId(user_id)
+    except (InvalidId, TypeError):
+        return None
+    u = await USERS().find_one({"_id": oid}, _PRINCIPAL_FIELDS)
+    if not u:
+        return None
+    u["_id"] = str(u["_id"])
+    _PRINCIPALS.set(user_id, u)
+    return dict(u)
+
+def invalidate_principal(user_id: str):
+    _PRINCIPALS.pop(str(user_id))
+
+def principal_stats() -> dict:
+    return _PRINCIPALS.stats()
+
 async def update_user(user_id: str, update_dict: dict):
     await USERS().update_one({"_id": ObjectId(user_id)}, {"$set": update_dict})
+    invalidate_principal(user_id)
     return await find_user_by_id(user_id)
 
 async def change_password(user_id: str, old_password: str, new_password: str):
     u = await find_user_by_id(user_id)
     if not u:
         return False
-    if not verify_password(old_password, u["password"]):
+    if not await verify_password_async(old_password, u["password"]):
         return False
-    hashed = hash_password(new_password)
+    hashed = await hash_password_async(new_password)
     await USERS().update_one({"_id": ObjectId(user_id)}, {"$set": {"password": hashed}})
+    invalidate_principal(user_id)
     return True
 
 async def generate_password_reset(email: str):
@@ -84,8 +115,9 @@ async def verify_and_reset_password(token: str, new_password: str):
         return False
     if info["expires_at"] < datetime.utcnow():
         return False
-    hashed = hash_password(new_password)
+    hashed = await hash_password_async(new_password)
     await USERS().update_one({"_id": u["_id"]}, {"$set": {"password": hashed, "password_reset": None}})
+    invalidate_principal(u["_id"])
     return True
 
 def create_jwt_for_user(user: dict):
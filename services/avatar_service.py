@@ -0,0 +1,157 @@
+"""
+Uploaded avatars, kept out of the `users` collection in the `avatars` GridFS
+bucket. An upload is decoded once, cropped to a square thumbnail per entry in
+AVATAR_SIZES and stored under the SHA-256 of the original bytes, so identical
+uploads share files and the digest doubles as a strong ETag. Users reference
+an upload by `avatar_id`; predefined avatars stay plain URLs in `avatar`.
+"""
+import hashlib
+import io
+from typing import Optional
+
+from bson.binary import Binary
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from core.cache import TTLCache
+from core.config import settings
+from core.security import bytes_to_base64
+from core.workers import io_pool
+from db.mongodb import get_db
+
+_CONTENT_TYPES = {"WEBP": "image/webp", "PNG": "image/png", "JPEG": "image/jpeg"}
+# thumbnails are immutable once stored, so they only leave memory by LRU
+_THUMBNAILS = TTLCache(maxsize=settings.AVATAR_CACHE_SIZE)
+
+
+def _bucket():
+    return AsyncIOMotorGridFSBucket(get_db(), bucket_name="avatars")
+
+def _filename(digest: str, size: int) -> str:
+    return f"{digest}/{size}"
+
+
+def pick_size(requested: Optional[int]) -> int:
+    """The smallest stored size at least `requested` pixels wide, or the largest one."""
+    sizes = sorted(settings.AVATAR_SIZES)
+    if not requested:
+        requested = settings.AVATAR_DEFAULT_SIZE
+    return next((s for s in sizes if s >= requested), sizes[-1])
+
+
+def _render(data: bytes) -> dict[int, bytes]:
+    """Decode an upload and encode one square thumbnail per size. Runs on the io pool."""
+    try:
+        image = Image.open(io.BytesIO(data))
+        # width/height come from the header, so oversized images are refused before decoding
+        if image.width * image.height > settings.AVATAR_MAX_PIXELS:
+            raise ValueError(f"Avatar is larger than {settings.AVATAR_MAX_PIXELS} pixels")
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise ValueError("Avatar must be a PNG, JPEG, GIF or WebP image")
+
+    image = ImageOps.exif_transpose(image)
+    keep_alpha = settings.AVATAR_FORMAT != "JPEG" and (image.mode in ("RGBA", "LA") or "transparency" in image.info)
+    image = image.convert("RGBA" if keep_alpha else "RGB")
+    thumbnails = {}
+    for size in settings.AVATAR_SIZES:
+        buf = io.BytesIO()
+        ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS).save(buf, format=settings.AVATAR_FORMAT, quality=85)
+        thumbnails[size] = buf.getvalue()
+    return thumbnails
+
+
+def _too_large() -> ValueError:
+    return ValueError(f"Avatar exceeds {settings.AVATAR_MAX_BYTES // (1024 * 1024)} MB")
+
+
+async def read_upload(upload) -> bytes:
+    """An uploaded avatar's bytes, refused (ValueError) without buffering more than AVATAR_MAX_BYTES."""
+    if upload.size is not None and upload.size > settings.AVATAR_MAX_BYTES:
+        raise _too_large()
+    data = await upload.read(settings.AVATAR_MAX_BYTES + 1)
+    if len(data) > settings.AVATAR_MAX_BYTES:
+        raise _too_large()
+    return data
+
+
+async def store_avatar(data: bytes) -> str:
+    """
+    Store an uploaded image and return its avatar id (the content digest).
+    Raises ValueError for empty, oversized or undecodable uploads and
+    WorkerPoolSaturated when the io pool is full.
+    """
+    if not data:
+        raise ValueError("Avatar file is empty")
+    if len(data) > settings.AVATAR_MAX_BYTES:
+        raise _too_large()
+    digest = hashlib.sha256(data).hexdigest()
+    sizes = sorted(settings.AVATAR_SIZES)
+    # sizes are written smallest first, so the largest one existing means the set is complete
+    if await get_db().avatars.files.find_one({"filename": _filename(digest, sizes[-1])}, {"_id": 1}):
+        return digest
+
+    thumbnails = await io_pool.run(_render, data)
+    bucket = _bucket()
+    content_type = _CONTENT_TYPES.get(settings.AVATAR_FORMAT, "application/octet-stream")
+    for size in sizes:
+        await bucket.upload_from_stream(
+            _filename(digest, size),
+            thumbnails[size],
+            metadata={"digest": digest, "size": size, "content_type": content_type},
+        )
+    return digest
+
+
+async def get_thumbnail(digest: str, size: int) -> Optional[tuple[bytes, str]]:
+    """(image bytes, content type) for a stored size, or None if it doesn't exist."""
+    key = (digest, size)
+    cached = _THUMBNAILS.get(key)
+    if cached is not None:
+        return cached
+    try:
+        stream = await _bucket().open_download_stream_by_name(_filename(digest, size))
+    except NoFile:
+        return None
+    data = await stream.read()
+    item = (data, (stream.metadata or {}).get("content_type", "application/octet-stream"))
+    _THUMBNAILS.set(key, item)
+    return item
+
+
+async def release_avatar(digest: str):
+    """Delete an avatar's files once no user references it any more."""
+    db = get_db()
+    if await db.users.find_one({"avatar_id": digest}, {"_id": 1}):
+        return
+    bucket = _bucket()
+    async for f in db.avatars.files.find({"metadata.digest": digest}, {"_id": 1}):
+        await bucket.delete(f["_id"])
+    for size in settings.AVATAR_SIZES:
+        _THUMBNAILS.pop((digest, size))
+
+
+def version(digest: str) -> str:
+    """The `v` token avatar URLs carry; only a request naming exactly this is served as immutable."""
+    return digest[:16]
+
+
+def avatar_url(user: dict) -> Optional[str]:
+    """
+    What API responses put in `avatar`: the versioned /users/{id}/avatar URL
+    for uploads, the URL itself for predefined avatars, and a base64 data URI
+    for avatars still embedded in the user document (see scripts/migrate_avatars.py).
+    """
+    if user.get("avatar_id"):
+        return f"{settings.AVATAR_BASE_URL}/users/{user['_id']}/avatar?v={version(user['avatar_id'])}"
+    avatar = user.get("avatar")
+    if isinstance(avatar, str):
+        return avatar
+    if isinstance(avatar, (bytes, Binary)):
+        return bytes_to_base64(bytes(avatar))
+    return None
+
+
+def stats() -> dict:
+    return _THUMBNAILS.stats()
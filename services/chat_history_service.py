@@ -0,0 +1,87 @@
+"""
+Session history for PDF chat: an in-process LRU/TTL tier in front of the
+`pdf_chat_sessions` collection, so history survives restarts and is shared
+between uvicorn workers while hot sessions are served from memory. Every read
+checks the session's `updated_at` in Mongo, so a turn appended by another
+worker is never missed; only the messages themselves come from memory.
+"""
+from datetime import datetime
+from typing import Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, messages_from_dict, messages_to_dict
+from pymongo import ReturnDocument
+
+from core.cache import TTLCache
+from core.config import settings
+from db.mongodb import get_db
+
+# key -> (updated_at of the stored session, messages); an entry is only used while
+# updated_at still matches Mongo. The TTL just bounds memory for idle sessions.
+_CACHE = TTLCache(maxsize=settings.CHAT_HISTORY_CACHE_SIZE, ttl=settings.CHAT_HISTORY_CACHE_TTL_SECONDS)
+
+
+def SESSIONS():
+    return get_db().pdf_chat_sessions
+
+def _now():
+    # BSON dates keep milliseconds; truncate so a cached updated_at compares equal to the stored one
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def _max_messages() -> int:
+    return settings.CHAT_HISTORY_MAX_TURNS * 2
+
+
+def session_key(user_id: Optional[str], document_id: str, session_id: Optional[str] = None) -> str:
+    """History is scoped per user and per document; session_id separates parallel conversations."""
+    return f"{user_id or 'anonymous'}:{document_id}:{session_id or 'default'}"
+
+
+async def get_history(key: str) -> list:
+    """Return the stored messages (oldest first) for a session key."""
+    cached = _CACHE.get(key)
+    if cached is not None:
+        head = await SESSIONS().find_one({"_id": key}, {"updated_at": 1})
+        if (head or {}).get("updated_at") == cached[0]:
+            return list(cached[1])
+    doc = await SESSIONS().find_one({"_id": key}, {"messages": 1, "updated_at": 1})
+    messages = messages_from_dict(doc["messages"]) if doc and doc.get("messages") else []
+    _CACHE.set(key, ((doc or {}).get("updated_at"), messages))
+    return list(messages)
+
+
+async def append_turn(key: str, question: str, answer: str):
+    """Store one question/answer pair, keeping only the last CHAT_HISTORY_MAX_TURNS turns."""
+    turn = [HumanMessage(content=question), AIMessage(content=answer)]
+    now = _now()
+    before = await SESSIONS().find_one_and_update(
+        {"_id": key},
+        {
+            "$push": {"messages": {"$each": messages_to_dict(turn), "$slice": -_max_messages()}},
+            "$set": {"updated_at": now},
+            "$setOnInsert": {"created_at": now},
+        },
+        projection={"updated_at": 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+    cached = _CACHE.peek(key)
+    # extend the cached copy only if nobody else wrote in between; otherwise reload on the next read
+    if cached is not None and (before or {}).get("updated_at") == cached[0]:
+        _CACHE.set(key, (now, (cached[1] + turn)[-_max_messages():]))
+    else:
+        _CACHE.pop(key)
+
+
+async def clear_history(key: str):
+    _CACHE.pop(key)
+    await SESSIONS().delete_one({"_id": key})
+
+
+def stats() -> dict:
+    sessions = _CACHE.values()
+    return {
+        **_CACHE.stats(),
+        "resident_messages": sum(len(m) for _, m in sessions),
+        "resident_chars": sum(len(str(msg.content)) for _, m in sessions for msg in m),
+    }
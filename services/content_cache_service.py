@@ -0,0 +1,86 @@
+"""
+Caches for /summarize: fetched transcripts/page text keyed by canonical YouTube
+video id or normalized URL, and generated summaries keyed by content hash +
+prompt version + model name.
+"""
+import hashlib
+import re
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from core.cache import TieredCache
+from core.config import settings
+
+_VIDEO_ID = re.compile(r"^[A-Za-z0-9_-]{11}$")
+_TRACKING_PREFIXES = ("utm_",)
+_TRACKING_PARAMS = {"fbclid", "gclid", "si"}
+
+content_cache = TieredCache(
+    "content_cache",
+    maxsize=settings.CONTENT_CACHE_SIZE,
+    ttl_seconds=settings.CONTENT_CACHE_TTL_HOURS * 3600,
+)
+summary_cache = TieredCache(
+    "summary_cache",
+    maxsize=settings.CONTENT_CACHE_SIZE,
+    ttl_seconds=settings.SUMMARY_CACHE_TTL_HOURS * 3600,
+)
+
+
+def youtube_video_id(url: str) -> Optional[str]:
+    """
+    Extract the 11-character video id from any common YouTube URL form
+    (watch?v=, youtu.be/, /embed/, /shorts/, /live/), ignoring timestamps and
+    playlist parameters. Returns None for non-YouTube URLs.
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    for prefix in ("www.", "m.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+
+    candidate = None
+    if host == "youtu.be":
+        candidate = parts.path.strip("/").split("/")[0]
+    elif host in ("youtube.com", "youtube-nocookie.com"):
+        segments = parts.path.strip("/").split("/")
+        if segments[0] == "watch":
+            candidate = dict(parse_qsl(parts.query)).get("v")
+        elif len(segments) > 1 and segments[0] in ("embed", "shorts", "live", "v"):
+            candidate = segments[1]
+    return candidate if candidate and _VIDEO_ID.match(candidate) else None
+
+
+def normalize_url(url: str) -> str:
+    """Lowercase scheme/host, drop fragments, default ports, tracking params and trailing slashes, sort the query."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.startswith(_TRACKING_PREFIXES) and k not in _TRACKING_PARAMS
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def content_key(url: str) -> str:
+    video_id = youtube_video_id(url)
+    return f"yt:{video_id}" if video_id else f"url:{normalize_url(url)}"
+
+
+def canonical_url(url: str) -> str:
+    """The URL actually fetched for a cache key, so equivalent links load identically."""
+    video_id = youtube_video_id(url)
+    return f"https://www.youtube.com/watch?v={video_id}" if video_id else url
+
+
+def summary_key(text: str, prompt_version: str, model_name: str) -> str:
+    content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{content_hash}:{prompt_version}:{model_name}"
+
+
+def stats() -> dict:
+    return {"content": content_cache.stats(), "summary": summary_cache.stats()}
@@ -0,0 +1,154 @@
+"""
+Graph checks for generated flowcharts: structural validation, cycle and orphan
+detection, and level assignment. Everything here is O(V + E) so it stays cheap
+on the 40+ node diagrams the model is asked for and on much larger ones.
+"""
+from collections import deque
+
+MAX_REPORTED_ERRORS = 20
+
+
+def structural_errors(data) -> list[str]:
+    """
+    Schema problems that make a flowchart unusable: missing or non-list
+    nodes/edges, nodes without id/label, edges without from/to or pointing at
+    unknown node ids. Returns an empty list for a valid flowchart.
+    """
+    if not isinstance(data, dict):
+        return ["flowchart is not a JSON object"]
+    if not isinstance(data.get("nodes"), list) or not isinstance(data.get("edges"), list):
+        return ["flowchart needs 'nodes' and 'edges' arrays"]
+
+    errors = []
+    node_ids = set()
+    for i, node in enumerate(data["nodes"]):
+        if not isinstance(node, dict) or "id" not in node or "label" not in node:
+            errors.append(f"nodes[{i}] needs 'id' and 'label'")
+        else:
+            node_ids.add(node["id"])
+    for i, edge in enumerate(data["edges"]):
+        if not isinstance(edge, dict) or "from" not in edge or "to" not in edge:
+            errors.append(f"edges[{i}] needs 'from' and 'to'")
+        elif edge["from"] not in node_ids or edge["to"] not in node_ids:
+            errors.append(f"edges[{i}] references an unknown node ({edge['from']} -> {edge['to']})")
+        if len(errors) >= MAX_REPORTED_ERRORS:
+            break
+    return errors[:MAX_REPORTED_ERRORS]
+
+
+def adjacency(nodes: list[dict], edges: list[dict]):
+    """Return (node ids in declaration order, successor lists, in-degrees); edges to unknown ids are skipped."""
+    ids = list(dict.fromkeys(n["id"] for n in nodes))
+    succ: dict = {nid: [] for nid in ids}
+    indegree: dict = {nid: 0 for nid in ids}
+    for edge in edges:
+        src, tgt = edge["from"], edge["to"]
+        if src in succ and tgt in succ:
+            succ[src].append(tgt)
+            indegree[tgt] += 1
+    return ids, succ, indegree
+
+
+def cycle_nodes(ids: list, succ: dict) -> list[list]:
+    """
+    Strongly connected components that contain a cycle (size > 1, or a
+    self-loop), via an iterative Tarjan so deep graphs can't hit the recursion limit.
+    """
+    index: dict = {}
+    low: dict = {}
+    on_stack: set = set()
+    stack: list = []
+    cycles: list[list] = []
+    counter = 0
+
+    for root in ids:
+        if root in index:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, i = work.pop()
+            if i == 0:
+                index[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack.add(node)
+            children = succ[node]
+            if i < len(children):
+                work.append((node, i + 1))
+                child = children[i]
+                if child not in index:
+                    work.append((child, 0))
+                elif child in on_stack:
+                    low[node] = min(low[node], index[child])
+                continue
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1 or node in succ[node]:
+                    cycles.append(component[::-1])
+    return cycles
+
+
+def compute_levels(ids: list, succ: dict, indegree: dict) -> dict:
+    """
+    Level = shortest distance from the nearest root (node with no incoming
+    edge), computed with one multi-source BFS. Nodes only reachable through a
+    cycle with no root get their own BFS seeded at level 0, in declaration order.
+    """
+    levels: dict = {}
+    queue = deque()
+    for nid in ids:
+        if indegree[nid] == 0:
+            levels[nid] = 0
+            queue.append(nid)
+
+    def drain():
+        while queue:
+            current = queue.popleft()
+            for neighbor in succ[current]:
+                if neighbor not in levels:
+                    levels[neighbor] = levels[current] + 1
+                    queue.append(neighbor)
+
+    drain()
+    if len(levels) < len(ids):
+        for nid in ids:
+            if nid not in levels:
+                levels[nid] = 0
+                queue.append(nid)
+                drain()
+    return levels
+
+
+def analyze(data: dict) -> dict:
+    """
+    Full report for a flowchart: {"errors", "roots", "orphans", "cycles",
+    "duplicate_ids", "levels"}. Graph fields are empty when `errors` is not.
+    """
+    errors = structural_errors(data)
+    report = {"errors": errors, "roots": [], "orphans": [], "cycles": [], "duplicate_ids": [], "levels": {}}
+    if errors:
+        return report
+
+    ids, succ, indegree = adjacency(data["nodes"], data["edges"])
+    seen: set = set()
+    duplicates = []
+    for node in data["nodes"]:
+        if node["id"] in seen:
+            duplicates.append(node["id"])
+        seen.add(node["id"])
+
+    report["roots"] = [nid for nid in ids if indegree[nid] == 0]
+    report["orphans"] = [nid for nid in report["roots"] if not succ[nid]] if len(ids) > 1 else []
+    report["cycles"] = cycle_nodes(ids, succ)
+    report["duplicate_ids"] = duplicates
+    report["levels"] = compute_levels(ids, succ, indegree)
+    return report
@@ -0,0 +1,131 @@
+"""
+Stored architecture flowcharts. `flowcharts` holds the latest version of each
+diagram and `flowchart_versions` one document per version, so a refinement
+never loses the diagram it was based on. Both carry the owner's id and every
+lookup filters on it, so a flowchart id alone grants nothing.
+"""
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from db.mongodb import get_db
+
+
+def _now():
+    return datetime.utcnow()
+
+def _oid(id_: str) -> Optional[ObjectId]:
+    try:
+        return ObjectId(id_)
+    except (InvalidId, TypeError):
+        return None
+
+
+def _out(doc: dict) -> dict:
+    return {
+        "id": str(doc.get("flowchart_id", doc["_id"])),
+        "version": doc["version"],
+        "nodes": doc["nodes"],
+        "edges": doc["edges"],
+    }
+
+
+async def save_flowchart(prompt: str, flowchart: dict, owner_id: str) -> dict:
+    """Store a freshly generated flowchart as version 1, owned by `owner_id`."""
+    db = get_db()
+    now = _now()
+    owner = ObjectId(owner_id)
+    doc = {
+        "owner_id": owner,
+        "prompt": prompt,
+        "version": 1,
+        "nodes": flowchart["nodes"],
+        "edges": flowchart["edges"],
+        "created_at": now,
+        "updated_at": now,
+    }
+    res = await db.flowcharts.insert_one(doc)
+    await db.flowchart_versions.insert_one({
+        "flowchart_id": res.inserted_id,
+        "owner_id": owner,
+        "version": 1,
+        "nodes": flowchart["nodes"],
+        "edges": flowchart["edges"],
+        "instruction": None,
+        "patch": None,
+        "created_at": now,
+    })
+    doc["_id"] = res.inserted_id
+    return _out(doc)
+
+
+async def get_flowchart(flowchart_id: str, owner_id: str, version: Optional[int] = None) -> Optional[dict]:
+    """The latest version, or a specific one. Returns None if either doesn't exist or isn't owned by `owner_id`."""
+    oid, owner = _oid(flowchart_id), _oid(owner_id)
+    if oid is None or owner is None:
+        return None
+    db = get_db()
+    if version is None:
+        doc = await db.flowcharts.find_one({"_id": oid, "owner_id": owner}, {"version": 1, "nodes": 1, "edges": 1, "prompt": 1})
+    else:
+        doc = await db.flowchart_versions.find_one({"flowchart_id": oid, "owner_id": owner, "version": version})
+    if not doc:
+        return None
+    out = _out(doc)
+    if "prompt" in doc:
+        out["prompt"] = doc["prompt"]
+    return out
+
+
+async def list_versions(flowchart_id: str, owner_id: str) -> Optional[list[dict]]:
+    oid, owner = _oid(flowchart_id), _oid(owner_id)
+    if oid is None or owner is None:
+        return None
+    db = get_db()
+    cursor = db.flowchart_versions.find(
+        {"flowchart_id": oid, "owner_id": owner},
+        {"version": 1, "instruction": 1, "created_at": 1, "nodes.id": 1, "edges.from": 1},
+    ).sort("version", 1)
+    versions = []
+    async for doc in cursor:
+        versions.append({
+            "version": doc["version"],
+            "instruction": doc.get("instruction"),
+            "created_at": doc["created_at"],
+            "nodes": len(doc.get("nodes", [])),
+            "edges": len(doc.get("edges", [])),
+        })
+    return versions or None
+
+
+async def save_version(flowchart_id: str, owner_id: str, base_version: int, flowchart: dict, instruction: str, patch: dict) -> dict:
+    """
+    Store `flowchart` as the next version after `base_version`.
+    Raises ValueError if another refinement was saved on top of base_version
+    first, or if the flowchart isn't owned by `owner_id`.
+    """
+    oid, owner = _oid(flowchart_id), _oid(owner_id)
+    db = get_db()
+    now = _now()
+    res = await db.flowcharts.update_one(
+        {"_id": oid, "owner_id": owner, "version": base_version},
+        {
+            "$set": {"nodes": flowchart["nodes"], "edges": flowchart["edges"], "updated_at": now},
+            "$inc": {"version": 1},
+        },
+    )
+    if res.matched_count == 0:
+        raise ValueError(f"Flowchart changed since version {base_version}; refine the latest version instead")
+    await db.flowchart_versions.insert_one({
+        "flowchart_id": oid,
+        "owner_id": owner,
+        "version": base_version + 1,
+        "nodes": flowchart["nodes"],
+        "edges": flowchart["edges"],
+        "instruction": instruction,
+        "patch": patch,
+        "created_at": now,
+    })
+    return {"id": flowchart_id, "version": base_version + 1, **flowchart}
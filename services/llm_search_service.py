@@ -1,34 +1,47 @@
+import asyncio
 import os
+import re
 from typing import Optional
+from core import llm_gateway, registry
+from core.cache import TieredCache
 from core.config import settings
+from core.singleflight import SingleFlight
+from services import semantic_cache_service
 
-from langchain_groq import ChatGroq
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_community.utilities import ArxivAPIWrapper, WikipediaAPIWrapper
 from langchain_community.tools import ArxivQueryRun, WikipediaQueryRun, DuckDuckGoSearchRun
-from langchain_classic.agents import initialize_agent, AgentType
 
+# the model asks for another lookup by replying with this prefix instead of an answer
+FOLLOW_UP_PREFIX = "SEARCH:"
 
-def run_search(query: str, api_key: Optional[str] = None) -> str:
-    """
-    Run the LLM-powered search agent on the given query and return the agent's response string.
-    Raises RuntimeError if deps or API key missing.
-    """
+SYSTEM_PROMPT = """You are a concise web-search assistant.
+Answer the user's question clearly using the search results provided.
+{instructions}"""
 
-    prompt = f"""
-    You are a concise web-search assistant.
-    Answer the question below clearly using the tools available.
-    If you find enough information, stop immediately.
+CAN_SEARCH_AGAIN = (
+    f"If the results are not enough to answer, reply with exactly one line '{FOLLOW_UP_PREFIX} <better search query>' "
+    "and nothing else. Otherwise answer directly."
+)
+MUST_ANSWER = "Answer now with the information available; say briefly if something could not be confirmed."
 
-    Question: {query}
-    """
+synthesis_prompt = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", "Question: {query}\n\nSearch results:\n{observations}"),
+])
 
+# identical searches running at the same time share one run
+_SEARCHES = SingleFlight("llm_search")
+
+tool_cache = TieredCache(
+    "search_tool_cache",
+    maxsize=settings.SEARCH_TOOL_CACHE_SIZE,
+    ttl_seconds=settings.SEARCH_TOOL_CACHE_TTL_HOURS * 3600,
+    persist=settings.SEARCH_TOOL_CACHE_PERSIST,
+)
 
-    # ✅ Prefer passed API key, else fallback to env or settings
-    key = api_key or getattr(settings, "GROQ_API_KEY", None) or os.getenv("GROQ_API_KEY")
-    if not key:
-        raise RuntimeError("Groq API key missing. Set GROQ_API_KEY or pass api_key parameter.")
 
-    # Initialize wrappers and tools
+def _build_tools():
     arxiv_wrapper = ArxivAPIWrapper(top_k_results=1, doc_content_chars_max=200)
     arxiv = ArxivQueryRun(api_wrapper=arxiv_wrapper)
 
@@ -37,24 +50,222 @@ def run_search(query: str, api_key: Optional[str] = None) -> str:
 
     search = DuckDuckGoSearchRun(name="Search")
 
-    llm = ChatGroq(
-        groq_api_key=key,
-        model_name="Llama-3.1-8b-instant",
-        streaming=False
-    )
+    return [search, arxiv, wiki]
+
+
+def _get_llm(api_key: Optional[str] = None):
+    # ✅ Prefer passed API key, else fallback to env or settings
+    key = api_key or getattr(settings, "GROQ_API_KEY", None) or os.getenv("GROQ_API_KEY")
+    if not key:
+        raise RuntimeError("Groq API key missing. Set GROQ_API_KEY or pass api_key parameter.")
+    return llm_gateway.chat_model(settings.SEARCH_MODEL_NAME, caller="llm_search", priority=llm_gateway.INTERACTIVE, api_key=key)
+
+
+def normalize_query(query: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a search query."""
+    return re.sub(r"\s+", " ", query).strip().strip("?!.").strip().lower()
+
+
+def _tool_cache_key(tool, query: str) -> str:
+    return f"{tool.name.lower()}:{normalize_query(query)}"
+
+
+async def _run_tool(tool, query: str) -> str:
+    """Call a search tool, reusing an earlier result for the same normalized query."""
+    key = _tool_cache_key(tool, query)
+    cached = await tool_cache.get(key)
+    if cached is not None:
+        return cached
+    result = await tool.ainvoke(query)
+    if result:
+        await tool_cache.set(key, str(result))
+    return result
+
+
+async def _lookup(tools: list, query: str, timeout: float) -> list[dict]:
+    """Run every tool on `query` concurrently; lookups still running at `timeout` are dropped."""
+    if timeout <= 0:
+        return []
+    tasks = {asyncio.create_task(_run_tool(tool, query)): tool for tool in tools}
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    observations = []
+    for task in done:
+        if task.exception() is None and task.result():
+            result = str(task.result())[:settings.SEARCH_OBSERVATION_CHARS]
+            observations.append({"tool": tasks[task].name, "query": query, "result": result})
+    return observations
+
+
+def _format_observations(observations: list[dict]) -> str:
+    if not observations:
+        return "(no results)"
+    return "\n".join(f"[{o['tool']}: {o['query']}] {o['result']}" for o in observations)
+
+
+def _partial_answer(observations: list[dict]) -> str:
+    if not observations:
+        return "The search did not finish in time and returned no results. Please try again."
+    lines = "\n".join(f"- **{o['tool']}**: {o['result']}" for o in observations)
+    return f"The search did not finish in time; here is what the sources returned so far:\n\n{lines}"
+
+
+async def _search_events(query: str, api_key: Optional[str] = None, deadline_seconds: Optional[float] = None, max_steps: Optional[int] = None):
+    """
+    Async search engine. Each step runs DuckDuckGo, Arxiv and Wikipedia concurrently,
+    then asks the model to answer or request one follow-up query. The whole run is
+    bounded by `deadline_seconds` and `max_steps`; when either runs out, the answer
+    is built from whatever the tools returned.
+
+    Yields progress dicts ({"step", "input", "sources"}), answer text chunks as the
+    model streams them, and a final {"partial", "steps"} dict.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (deadline_seconds or settings.SEARCH_DEADLINE_SECONDS)
+    max_steps = max_steps or settings.SEARCH_MAX_STEPS
+    llm = _get_llm(api_key)
+    tools = registry.get("search_tools", _build_tools)
+
+    observations: list[dict] = []
+    searched: set[str] = set()
+    current = query
+    step = 0
+    while step < max_steps:
+        step += 1
+        if normalize_query(current) not in searched:
+            searched.add(normalize_query(current))
+            found = await _lookup(tools, current, deadline - loop.time())
+            observations.extend(found)
+            yield {"step": step, "input": current, "sources": [o["tool"] for o in found]}
+        if loop.time() >= deadline:
+            break
+
+        final_step = step == max_steps
+        inputs = {
+            "query": query,
+            "observations": _format_observations(observations),
+            "instructions": MUST_ANSWER if final_step else CAN_SEARCH_AGAIN,
+        }
+        buffered = ""
+        streaming = False
+        timed_out = False
+        chunks = (synthesis_prompt | llm).astream(inputs)
+        try:
+            while True:
+                # the deadline bounds each read, never a yield: a timeout scope around a yield
+                # would also fire while the consumer (e.g. an SSE send) holds this generator
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), max(deadline - loop.time(), 0))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    timed_out = True
+                    break
+                text = chunk.content
+                if not text:
+                    continue
+                if streaming:
+                    yield text
+                    continue
+                buffered += text
+                head = buffered.lstrip().upper()
+                # hold output back while it could still turn out to be a follow-up request
+                if not final_step and (head.startswith(FOLLOW_UP_PREFIX) or FOLLOW_UP_PREFIX.startswith(head)):
+                    continue
+                streaming = True
+                yield buffered
+        finally:
+            await chunks.aclose()
+        if timed_out:
+            if streaming:
+                yield "\n\n_(answer cut off at the search deadline)_"
+                yield {"partial": True, "steps": step}
+                return
+            break
+
+        reply = buffered.strip()
+        if streaming or (reply and not reply.upper().startswith(FOLLOW_UP_PREFIX)):
+            if not streaming:
+                yield reply
+            yield {"partial": False, "steps": step}
+            return
+        if final_step:
+            break
+        follow_up = reply[len(FOLLOW_UP_PREFIX):].strip().splitlines()
+        if not follow_up or not follow_up[0] or normalize_query(follow_up[0]) in searched:
+            # nothing new to look up; answer with what we have on the next step
+            max_steps = step + 1
+        else:
+            current = follow_up[0]
+
+    yield _partial_answer(observations)
+    yield {"partial": True, "steps": step}
+
+
+def _cache_scope(scope: Optional[str]) -> str:
+    return f"search:{scope or 'global'}"
+
+
+async def lookup_cached(query: str, scope: Optional[str] = None, bypass_cache: bool = False) -> tuple:
+    """
+    (cached answer or None, query vector) from the semantic cache, to pass to
+    stream_search as `lookup`. Raises WorkerPoolSaturated when the io pool is full.
+    """
+    return await semantic_cache_service.lookup(_cache_scope(scope), query, bypass=bypass_cache)
+
+
+async def stream_search(query: str, api_key: Optional[str] = None, scope: Optional[str] = None, bypass_cache: bool = False,
+                        lookup: Optional[tuple] = None):
+    """
+    Same events as _search_events, but answers a paraphrase of a recent question in
+    `scope` (e.g. a playground) from the semantic cache, and caches complete answers.
+    """
+    if lookup is None:
+        lookup = await lookup_cached(query, scope, bypass_cache)
+    cached, vector = lookup
+    scope = _cache_scope(scope)
+    if cached is not None:
+        yield cached
+        yield {"partial": False, "steps": 0, "cached": True}
+        return
+
+    parts = []
+    partial = True
+    async for item in _search_events(query, api_key):
+        if isinstance(item, dict):
+            partial = item.get("partial", partial)
+        else:
+            parts.append(item)
+        yield item
+    if not partial:
+        semantic_cache_service.store(scope, vector, query, "".join(parts))
+
+
+async def run_search(query: str, api_key: Optional[str] = None, scope: Optional[str] = None, bypass_cache: bool = False) -> dict:
+    """
+    Run the async search engine on the given query.
+    Returns {"answer", "partial", "steps"}; `partial` is True when the deadline or
+    step budget ran out before the model produced a full answer.
+    Raises RuntimeError if deps or API key missing.
+    """
+    if api_key and api_key != settings.GROQ_API_KEY:
+        return await _run_search(query, api_key, scope, bypass_cache)
+    key = f"{scope or 'global'}:{int(bypass_cache)}:{normalize_query(query)}"
+    return dict(await _SEARCHES.do(key, lambda: _run_search(query, None, scope, bypass_cache)))
 
-    tools = [search, arxiv, wiki]
 
-    # ✅ Initialize agent (latest API)
-    agent = initialize_agent(
-        tools=tools,
-        llm=llm,
-        agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-        handle_parsing_errors=True,
-        verbose=True
-    )
+async def _run_search(query: str, api_key: Optional[str], scope: Optional[str], bypass_cache: bool) -> dict:
+    parts = []
+    meta = {"partial": False, "steps": 0}
+    async for item in stream_search(query, api_key, scope, bypass_cache):
+        if isinstance(item, dict):
+            if "partial" in item:
+                meta = item
+        else:
+            parts.append(item)
+    return {"answer": "".join(parts), **meta}
 
-    # ✅ Run the query (must be a string)
-    response = agent.run(prompt)
 
-    return response
+def stats() -> dict:
+    return {"tool_cache": tool_cache.stats()}
@@ -1,9 +1,19 @@
+import base64
+import binascii
+import calendar
 from bson import ObjectId
-from datetime import datetime
+from bson.errors import InvalidId
+from datetime import datetime, timedelta
+from typing import Optional
 from db.mongodb import get_db
 
+_EPOCH = datetime(1970, 1, 1)
+_MAX_CURSOR_MS = (datetime.max - _EPOCH) // timedelta(milliseconds=1)
+
 def _now():
-    return datetime.utcnow()
+    # BSON dates keep milliseconds; truncate so the returned timestamp matches the stored one
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
 
 
 async def create_message(playground_id: str, sender_id: str | None, content: str, sender_username: str | None = None):
@@ -26,21 +36,90 @@ async def create_message(playground_id: str, sender_id: str | None, content: str
     return doc
 
 
-async def list_messages(playground_id: str, limit: int = 100):
+def _out(m: dict) -> dict:
+    return {
+        "_id": str(m["_id"]),
+        "playground_id": str(m["playground_id"]) if m.get("playground_id") else None,
+        "sender_id": str(m["sender_id"]) if m.get("sender_id") else None,
+        "sender_username": m.get("sender_username"),
+        "content": m.get("content"),
+        "timestamp": m.get("timestamp"),
+    }
+
+
+def encode_cursor(message: dict) -> str:
+    """Opaque position of a stored message: its millisecond timestamp and id."""
+    ts = message["timestamp"]
+    ms = calendar.timegm(ts.timetuple()) * 1000 + ts.microsecond // 1000
+    raw = f"{ms}:{message['_id']}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        ms, message_id = raw.split(":")
+        ms = int(ms)
+        # timestamps are stored after the epoch; anything outside datetime's range is forged
+        if not 0 <= ms <= _MAX_CURSOR_MS:
+            raise ValueError
+        return _EPOCH + timedelta(milliseconds=ms), ObjectId(message_id)
+    except (ValueError, OverflowError, InvalidId, binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def _beyond(ts: datetime, message_id: ObjectId, op: str) -> dict:
+    # (timestamp, _id) strictly before ("$lt") or after ("$gt") the given position
+    return {"$or": [{"timestamp": {op: ts}}, {"timestamp": ts, "_id": {op: message_id}}]}
+
+
+async def page_messages(playground_id: str, limit: int = 50, before: Optional[str] = None,
+                        after: Optional[str] = None, since: Optional[datetime] = None) -> dict:
+    """
+    One page of a playground's messages, oldest first, walking the
+    (playground_id, timestamp, _id) index:
+
+    - no cursor: the latest `limit` messages
+    - `before`: the `limit` messages just older than that cursor
+    - `after`: the `limit` messages just newer than that cursor
+    - `since`: the first `limit` messages newer than a timestamp, for polling
+
+    Returns {"messages", "before", "after", "has_more"}: `before` is the cursor
+    for the next older page (None when there is none), `after` the cursor to
+    poll for newer messages, and `has_more` whether the walk in the requested
+    direction stopped at `limit`. Raises ValueError for a malformed cursor or
+    more than one of before/after/since.
+    """
+    if sum(x is not None for x in (before, after, since)) > 1:
+        raise ValueError("Use only one of before, after and since")
     db = get_db()
-    cursor = db.messages.find({"playground_id": ObjectId(playground_id)}).sort("timestamp", 1).limit(limit)
-    out = []
-    async for m in cursor:
-        m["_id"] = str(m["_id"])
-        m["playground_id"] = str(m["playground_id"]) if m.get("playground_id") else None
-        m["sender_id"] = str(m["sender_id"]) if m.get("sender_id") else None
-        # keep content and timestamp, normalize keys
-        out.append({
-            "_id": m["_id"],
-            "playground_id": m.get("playground_id"),
-            "sender_id": m.get("sender_id"),
-            "sender_username": m.get("sender_username"),
-            "content": m.get("content"),
-            "timestamp": m.get("timestamp"),
-        })
-    return out
+    query: dict = {"playground_id": ObjectId(playground_id)}
+    forward = after is not None or since is not None
+    if before is not None:
+        query.update(_beyond(*decode_cursor(before), "$lt"))
+    elif after is not None:
+        query.update(_beyond(*decode_cursor(after), "$gt"))
+    elif since is not None:
+        query["timestamp"] = {"$gt": since}
+
+    direction = 1 if forward else -1
+    cursor = db.messages.find(query).sort([("timestamp", direction), ("_id", direction)]).limit(limit + 1)
+    docs = [m async for m in cursor]
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if not forward:
+        docs.reverse()
+
+    # walking backwards, `limit` reached is the only sign of older messages
+    older = encode_cursor(docs[0]) if docs and (forward or has_more) else None
+    newer = encode_cursor(docs[-1]) if docs else after
+    return {
+        "messages": [_out(m) for m in docs],
+        "before": older,
+        "after": newer,
+        "has_more": has_more,
+    }
+
+
+async def list_messages(playground_id: str, limit: int = 100):
+    """The latest `limit` messages, oldest first."""
+    page = await page_messages(playground_id, limit=limit)
+    return page["messages"]
@@ -1,125 +1,246 @@
 from core.config import settings
-import os
-import tempfile
+import re
+import time
 from datetime import datetime
 from typing import Optional
 
-from langchain_classic.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain_classic.chains.combine_documents import create_stuff_documents_chain
-from langchain_chroma import Chroma
-from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_groq import ChatGroq
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
 
-_STORE: dict = {}
+from core import llm_gateway
+from core.singleflight import SingleFlight
+from core.workers import io_pool
+from services import chat_history_service, pdf_index_service, semantic_cache_service
 
 def _now():
     return datetime.utcnow()
 
 def _ensure_deps():
-    if create_history_aware_retriever is None:
+    if create_stuff_documents_chain is None:
         raise RuntimeError("PDF chat dependencies are not installed. Install the required langchain packages.")
 
-def _build_chain_from_pdf(path: str):
-    """Builds a conversational RAG chain from a local PDF file path."""
+CONTEXTUALIZE_Q_SYSTEM_PROMPT = (
+    "Given a chat history and the latest user question which might reference context in the chat history, "
+    "formulate a standalone question which can be understood without the chat history. Do NOT answer the question, "
+    "just reformulate it if needed and otherwise return it as is."
+)
+contextualize_q_prompt = ChatPromptTemplate.from_messages([
+    ("system", CONTEXTUALIZE_Q_SYSTEM_PROMPT),
+    MessagesPlaceholder("chat_history"),
+    ("human", "{input}"),
+])
+
+QA_SYSTEM_PROMPT = (
+    "You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer "
+    "the question. If you don't know the answer, say that you don't know. Use three sentences maximum and keep the "
+    "answer concise.\n\n{context}"
+)
+qa_prompt = ChatPromptTemplate.from_messages([
+    ("system", QA_SYSTEM_PROMPT),
+    MessagesPlaceholder("chat_history"),
+    ("human", "{input}"),
+])
+
+# words that usually mean a question leans on the previous turn
+_FOLLOW_UP_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their",
+    "he", "she", "his", "her", "above", "previous", "former", "latter", "same",
+    "more", "else", "also", "again",
+}
+
+# how often each rephrase strategy ran, to confirm skipped round-trips
+_REPHRASE_COUNTS = {"skipped": 0, "heuristic": 0, "llm": 0}
+
+
+def _rephrase_mode(history: list) -> str:
+    """Pick the rephrase strategy: none on a fresh session, otherwise the configured one."""
+    if len(history) < settings.PDF_CHAT_REPHRASE_MIN_MESSAGES:
+        return "skipped"
+    return "heuristic" if settings.PDF_CHAT_REPHRASE_MODE == "heuristic" else "llm"
+
+
+def _llm():
+    return llm_gateway.chat_model(caller="chat_pdf", priority=llm_gateway.INTERACTIVE)
+
+
+def _heuristic_rephrase(question: str, history: list) -> str:
+    """
+    Local stand-in for the LLM rephrase: when the question looks like a follow-up
+    (pronouns, very short), prefix the previous user question for retrieval.
+    """
+    words = set(re.findall(r"[a-z']+", question.lower()))
+    if len(words) > 3 and not (words & _FOLLOW_UP_WORDS):
+        return question
+    previous = next((m.content for m in reversed(history) if m.type == "human"), None)
+    return f"{previous}\n{question}" if previous else question
+
+
+async def _standalone_question(question: str, history: list, mode: str) -> str:
+    if mode == "skipped":
+        return question
+    if mode == "heuristic":
+        return _heuristic_rephrase(question, history)
+    chain = contextualize_q_prompt | _llm() | StrOutputParser()
+    return await chain.ainvoke({"input": question, "chat_history": history})
+
+
+async def _retrieve(vectorstore, query: str) -> list:
+    # embedding the query and searching Chroma block, so they run on the io pool;
+    # the Groq calls around this are async and stay on the event loop
+    return await io_pool.run(vectorstore.as_retriever().invoke, query)
+
+
+async def _answer(vectorstore, question: str, chat_history: list) -> dict:
+    """Rephrase (if needed), retrieve and generate, timing each stage."""
+    timings = {}
+    mode = _rephrase_mode(chat_history)
+    _REPHRASE_COUNTS[mode] += 1
+
+    started = time.perf_counter()
+    query = await _standalone_question(question, chat_history, mode)
+    timings["rephrase"] = time.perf_counter() - started
+
+    mark = time.perf_counter()
+    docs = await _retrieve(vectorstore, query)
+    timings["retrieve"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    qa_chain = create_stuff_documents_chain(_llm(), qa_prompt)
+    answer = await qa_chain.ainvoke({"input": question, "chat_history": chat_history, "context": docs})
+    timings["generate"] = time.perf_counter() - mark
+    timings["total"] = time.perf_counter() - started
+
+    return {
+        "answer": answer if isinstance(answer, str) else str(answer),
+        "rephrase": mode,
+        "timings": {k: round(v, 4) for k, v in timings.items()},
+    }
+
+
+# identical first-turn questions on the same document share one answer
+_ANSWERS = SingleFlight("chat_pdf")
+
+
+def _question_key(document_id: str, question: str) -> str:
+    normalized = re.sub(r"\s+", " ", question).strip().lower()
+    return f"{document_id}:{normalized}"
+
+
+def _cache_scope(document_id: str) -> str:
+    return f"pdf:{document_id}"
+
+
+def stats() -> dict:
+    return {"rephrase": dict(_REPHRASE_COUNTS)}
+
+
+async def ingest_pdf(path: str, document_id: str, filename: Optional[str] = None) -> dict:
+    """
+    Index a spooled PDF once so later questions can reference it by document id
+    (the SHA-256 of its bytes, computed while the upload was streamed).
+    Returns the document metadata plus `cached`, True when the same bytes were already indexed.
+    """
     _ensure_deps()
+    meta = await pdf_index_service.get_document(document_id)
+    if meta:
+        return {**meta, "cached": True}
+    _, meta, created = await pdf_index_service.build_index(path, document_id, filename)
+    return {**meta, "cached": not created}
+
 
-    # embeddings
-    hf_token = settings.HF_TOKEN
-    groq_api_key = settings.GROQ_API_KEY
-    if hf_token:
-        os.environ["HF_TOKEN"] = hf_token
-    if groq_api_key:
-        os.environ["GROQ_API_KEY"] = groq_api_key
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-    # load and split
-    loader = PyPDFLoader(path)
-    documents = loader.load()
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=5000, chunk_overlap=500)
-    splits = text_splitter.split_documents(documents)
-
-    vectorstore = Chroma.from_documents(documents=splits, embedding=embeddings)
-    retriever = vectorstore.as_retriever()
-
-    # prompts
-    contextualize_q_system_prompt = (
-        "Given a chat history and the latest user question which might reference context in the chat history, "
-        "formulate a standalone question which can be understood without the chat history. Do NOT answer the question, "
-        "just reformulate it if needed and otherwise return it as is."
-    )
-    contextualize_q_prompt = ChatPromptTemplate.from_messages([
-        ("system", contextualize_q_system_prompt),
-        MessagesPlaceholder("chat_history"),
-        ("human", "{input}"),
-    ])
-
-    history_aware_retriever = create_history_aware_retriever(ChatGroq(model_name=settings.GROQ_MODEL_NAME), retriever, contextualize_q_prompt)
-
-    system_prompt = (
-        "You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer "
-        "the question. If you don't know the answer, say that you don't know. Use three sentences maximum and keep the "
-        "answer concise.\n\n{context}"
-    )
-    qa_prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        MessagesPlaceholder("chat_history"),
-        ("human", "{input}"),
-    ])
-
-    question_answer_chain = create_stuff_documents_chain(ChatGroq(model_name=settings.GROQ_MODEL_NAME), qa_prompt)
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
-
-    # session history manager
-    def get_session_history(session: str) -> BaseChatMessageHistory:
-        if session not in _STORE:
-            _STORE[session] = ChatMessageHistory()
-        return _STORE[session]
-
-    conversational_rag_chain = RunnableWithMessageHistory(
-        rag_chain,
-        get_session_history,
-        input_messages_key="input",
-        history_messages_key="chat_history",
-        output_messages_key="answer",
-    )
-
-    return conversational_rag_chain
-
-
-def _write_temp_pdf(file_bytes: bytes, filename: Optional[str] = None) -> str:
-    suffix = ".pdf"
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    tmp.write(file_bytes)
-    tmp.flush()
-    tmp.close()
-    return tmp.name
-
-
-async def chat_with_pdf(file_bytes: bytes, question: str, session_id: Optional[str] = None) -> str:
+async def chat_with_document(document_id: str, question: str, user_id: Optional[str] = None, session_id: Optional[str] = None, bypass_cache: bool = False) -> dict:
     """
-    Process uploaded PDF bytes and answer the provided question using RAG.
-    Returns the assistant's answer string. Raises RuntimeError if deps missing.
+    Answer a question against a previously ingested PDF.
+    History is kept per user, per document and per session_id. First-turn questions
+    that paraphrase an earlier one on the same document are answered from the
+    semantic cache unless bypass_cache is set.
+    Returns {answer, rephrase, cached, timings}. Raises ValueError if the document is not indexed.
     """
     _ensure_deps()
-    tmp_path = _write_temp_pdf(file_bytes)
-    try:
-        chain = _build_chain_from_pdf(tmp_path)
-        sid = session_id or "default_session"
-        response = chain.invoke({"input": question}, config={"configurable": {"session_id": sid}})
-        # response expected to be dict-like with 'answer'
-        if isinstance(response, dict) and "answer" in response:
-            return response["answer"]
-        if isinstance(response, str):
-            return response
-        return str(response)
-    finally:
-        try:
-            os.unlink(tmp_path)
-        except Exception:
-            pass
+    started = time.perf_counter()
+    vectorstore = await pdf_index_service.get_index(document_id)
+    if vectorstore is None:
+        raise ValueError("Document not found; upload the PDF again")
+
+    key = chat_history_service.session_key(user_id, document_id, session_id)
+    history = await chat_history_service.get_history(key)
+
+    # only first-turn questions are context-free enough to answer from the semantic cache
+    cached, vector = None, None
+    if not history:
+        cached, vector = await semantic_cache_service.lookup(_cache_scope(document_id), question, bypass=bypass_cache)
+    prepared = time.perf_counter() - started
+    if cached is not None:
+        result = {"answer": cached, "rephrase": "skipped", "cached": True, "timings": {"load": round(prepared, 4)}}
+    else:
+        if history:
+            result = await _answer(vectorstore, question, history)
+        else:
+            async def first_turn():
+                answer = await _answer(vectorstore, question, [])
+                # inside the flight, so callers that join it don't store the same answer again
+                semantic_cache_service.store(_cache_scope(document_id), vector, question, answer["answer"])
+                return answer
+
+            shared = await _ANSWERS.do(_question_key(document_id, question), first_turn)
+            result = {**shared, "timings": dict(shared["timings"])}
+        result["timings"]["load"] = round(prepared, 4)
+        result["cached"] = False
+    await chat_history_service.append_turn(key, question, result["answer"])
+    return result
+
+
+async def stream_chat_with_document(document_id: str, question: str, user_id: Optional[str] = None, session_id: Optional[str] = None, bypass_cache: bool = False):
+    """
+    Async generator variant of chat_with_document that yields answer tokens as the
+    model produces them, preceded by {"stage", "seconds"} dicts as each stage finishes.
+    The full turn is stored in the session history at the end.
+    """
+    _ensure_deps()
+    vectorstore = await pdf_index_service.get_index(document_id)
+    if vectorstore is None:
+        raise ValueError("Document not found; upload the PDF again")
+
+    key = chat_history_service.session_key(user_id, document_id, session_id)
+    history = await chat_history_service.get_history(key)
+
+    cached, vector = None, None
+    if not history:
+        cached, vector = await semantic_cache_service.lookup(_cache_scope(document_id), question, bypass=bypass_cache)
+    if cached is not None:
+        yield {"stage": "semantic_cache", "hit": True}
+        yield cached
+        await chat_history_service.append_turn(key, question, cached)
+        return
+
+    mode = _rephrase_mode(history)
+    _REPHRASE_COUNTS[mode] += 1
+    mark = time.perf_counter()
+    query = await _standalone_question(question, history, mode)
+    yield {"stage": "rephrase", "mode": mode, "seconds": round(time.perf_counter() - mark, 4)}
+
+    mark = time.perf_counter()
+    docs = await _retrieve(vectorstore, query)
+    yield {"stage": "retrieve", "seconds": round(time.perf_counter() - mark, 4)}
+
+    qa_chain = create_stuff_documents_chain(_llm(), qa_prompt)
+    parts = []
+    async for token in qa_chain.astream({"input": question, "chat_history": history, "context": docs}):
+        if token:
+            parts.append(token)
+            yield token
+    answer = "".join(parts)
+    semantic_cache_service.store(_cache_scope(document_id), vector, question, answer)
+    await chat_history_service.append_turn(key, question, answer)
+
+
+async def chat_with_pdf(path: str, document_id: str, question: str, user_id: Optional[str] = None, session_id: Optional[str] = None, filename: Optional[str] = None, bypass_cache: bool = False) -> dict:
+    """
+    Answer the provided question about a spooled PDF upload using RAG.
+    The PDF is indexed under the SHA-256 of its bytes, so repeat questions against
+    the same file go straight to retrieval.
+    Returns {answer, rephrase, cached, timings}. Raises RuntimeError if deps missing.
+    """
+    await ingest_pdf(path, document_id, filename)
+    return await chat_with_document(document_id, question, user_id, session_id, bypass_cache)
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import shutil
+from datetime import datetime, timedelta
+from typing import Optional
+
+from langchain_chroma import Chroma
+
+from core import registry
+from core.cache import TTLCache
+from core.config import settings
+from core.workers import cpu_pool, io_pool
+from db.mongodb import get_db
+from services.pdf_parsing import load_and_split
+
+# Every PDF gets its own persist directory named after the SHA-256 of its bytes,
+# so the collection name inside it can stay fixed.
+_COLLECTION = "pdf_chunks"
+
+# open Chroma handles, so repeat questions don't even reopen the sqlite store
+_VECTORSTORES = TTLCache(maxsize=settings.PDF_INDEX_OPEN_HANDLES)
+_BUILD_LOCKS: dict[str, asyncio.Lock] = {}
+
+
+def DOCUMENTS():
+    return get_db().pdf_documents
+
+def _now():
+    return datetime.utcnow()
+
+def _index_path(document_id: str) -> str:
+    return os.path.join(settings.PDF_INDEX_DIR, document_id)
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+def _release_client(path: str):
+    # Chroma keeps one client per persist directory for the life of the process; a client
+    # left behind after its files are removed fails on the next open with a readonly or
+    # missing database, so stop and forget it.
+    from chromadb.api.client import SharedSystemClient
+
+    system = SharedSystemClient._identifier_to_system.pop(path, None)
+    if system is not None:
+        system.stop()
+
+
+def _drop_index(document_id: str):
+    """Delete a document's collection through Chroma, then its files. Runs on the io pool."""
+    path = _index_path(document_id)
+    if os.path.isdir(path):
+        try:
+            _open_index(document_id).delete_collection()
+        finally:
+            _release_client(path)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def _embed_into_index(splits: list, document_id: str):
+    """Embed chunks into a fresh persisted Chroma store, EMBED_BATCH_SIZE chunks per embedding call."""
+    # leftovers of an earlier, evicted or failed build
+    _drop_index(document_id)
+    os.makedirs(_index_path(document_id), exist_ok=True)
+    vectorstore = _open_index(document_id)
+    batch_size = max(settings.EMBED_BATCH_SIZE, 1)
+    for i in range(0, len(splits), batch_size):
+        vectorstore.add_documents(splits[i:i + batch_size])
+    return vectorstore
+
+
+def _open_index(document_id: str):
+    return Chroma(
+        collection_name=_COLLECTION,
+        embedding_function=registry.get_embeddings(),
+        persist_directory=_index_path(document_id),
+    )
+
+
+def _normalize(meta: dict) -> dict:
+    return {
+        "document_id": meta["_id"],
+        "filename": meta.get("filename"),
+        "pages": meta.get("pages"),
+        "chunks": meta.get("chunks"),
+        "size_bytes": meta.get("size_bytes"),
+        "created_at": meta.get("created_at"),
+        "last_accessed_at": meta.get("last_accessed_at"),
+    }
+
+
+async def get_document(document_id: str) -> Optional[dict]:
+    """Return index metadata for a document id, or None if it is not indexed on this host."""
+    meta = await DOCUMENTS().find_one({"_id": document_id})
+    if not meta:
+        return None
+    if not os.path.isdir(_index_path(document_id)):
+        # metadata outlived the files on disk (manual cleanup, different host)
+        await DOCUMENTS().delete_one({"_id": document_id})
+        _VECTORSTORES.pop(document_id)
+        return None
+    return _normalize(meta)
+
+
+async def _touch(document_id: str):
+    await DOCUMENTS().update_one(
+        {"_id": document_id},
+        {"$set": {"last_accessed_at": _now()}, "$inc": {"hits": 1}},
+    )
+
+
+async def get_index(document_id: str):
+    """Open the persisted vector store for a document, or None if it has not been indexed."""
+    vectorstore = _VECTORSTORES.get(document_id)
+    if vectorstore is None:
+        if not await get_document(document_id):
+            return None
+        vectorstore = await io_pool.run(_open_index, document_id)
+        _VECTORSTORES.set(document_id, vectorstore)
+    await _touch(document_id)
+    return vectorstore
+
+
+async def build_index(path: str, document_id: str, filename: Optional[str] = None):
+    """
+    Index the PDF at `path` under `document_id` unless another request already did.
+    Returns (vectorstore, metadata, created).
+    """
+    lock = _BUILD_LOCKS.setdefault(document_id, asyncio.Lock())
+    try:
+        async with lock:
+            vectorstore = await get_index(document_id)
+            if vectorstore is not None:
+                return vectorstore, await get_document(document_id), False
+
+            # parsing is pure-Python CPU work -> process pool; embedding releases the GIL
+            # and needs the shared model -> thread pool
+            splits, pages = await cpu_pool.run(load_and_split, path, filename)
+            if not splits:
+                raise ValueError("No extractable text found in PDF")
+            vectorstore = await io_pool.run(_embed_into_index, splits, document_id)
+            size_bytes = await io_pool.run(_dir_size, _index_path(document_id))
+
+            now = _now()
+            meta = {
+                "_id": document_id,
+                "filename": filename,
+                "pages": pages,
+                "chunks": len(splits),
+                "size_bytes": size_bytes,
+                "created_at": now,
+                "last_accessed_at": now,
+                "hits": 0,
+            }
+            await DOCUMENTS().replace_one({"_id": document_id}, meta, upsert=True)
+            _VECTORSTORES.set(document_id, vectorstore)
+    finally:
+        _BUILD_LOCKS.pop(document_id, None)
+
+    await evict_indexes(keep=document_id)
+    return vectorstore, _normalize(meta), True
+
+
+async def delete_index(document_id: str):
+    _VECTORSTORES.pop(document_id)
+    await io_pool.run(_drop_index, document_id)
+    await DOCUMENTS().delete_one({"_id": document_id})
+
+
+async def evict_indexes(keep: Optional[str] = None) -> int:
+    """
+    Drop indexes that exceed the TTL, then least-recently-used ones until the
+    document count and on-disk size are back under the configured limits.
+    Indexes with an open handle may be mid-query and are left for a later pass.
+    Returns the number of evicted documents.
+    """
+    expire_before = _now() - timedelta(hours=settings.PDF_INDEX_TTL_HOURS)
+    cursor = DOCUMENTS().find({}, {"size_bytes": 1, "last_accessed_at": 1}).sort("last_accessed_at", -1)
+
+    count = 0
+    total_bytes = 0
+    to_evict = []
+    async for meta in cursor:
+        size = meta.get("size_bytes") or 0
+        if meta["_id"] != keep and meta["_id"] not in _VECTORSTORES:
+            last = meta.get("last_accessed_at")
+            if (
+                last is None
+                or last < expire_before
+                or count + 1 > settings.PDF_INDEX_MAX_DOCUMENTS
+                or total_bytes + size > settings.PDF_INDEX_MAX_BYTES
+            ):
+                to_evict.append(meta["_id"])
+                continue
+        count += 1
+        total_bytes += size
+
+    for document_id in to_evict:
+        await delete_index(document_id)
+    return len(to_evict)
@@ -0,0 +1,42 @@
+"""
+PDF parsing and splitting, kept free of heavy imports so it can run inside
+the ingestion process pool (core.workers.cpu_pool).
+"""
+import mmap
+import os
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pypdf import PdfReader
+
+CHUNK_SIZE = 5000
+CHUNK_OVERLAP = 500
+
+
+def _read_pages(stream, source: str) -> list:
+    reader = PdfReader(stream)
+    return [
+        Document(page_content=page.extract_text() or "", metadata={"source": source, "page": i})
+        for i, page in enumerate(reader.pages)
+    ]
+
+
+def load_pages(path: str, source: str | None = None) -> list:
+    """Extract one Document per page, reading the file through a memory map where the platform allows it."""
+    source = source or os.path.basename(path)
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # empty files or filesystems without mmap support
+            return _read_pages(f, source)
+        with mapped:
+            return _read_pages(mapped, source)
+
+
+def load_and_split(path: str, source: str | None = None):
+    """Parse the PDF at `path` and split it into chunks. Returns (splits, page_count)."""
+    documents = load_pages(path, source)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    splits = text_splitter.split_documents(documents)
+    return splits, len(documents)
@@ -1,12 +1,26 @@
 from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime
+from typing import Optional
+from core.cache import TTLCache
+from core.config import settings
 from db.mongodb import get_db
 from services.message_service import list_messages
 
+# {owner, members} per playground, so authorizing a request is a dict lookup or one
+# projected find_one instead of get_playground(), which also loads the messages
+_ACCESS = TTLCache(maxsize=settings.PLAYGROUND_ACCESS_CACHE_SIZE, ttl=settings.PLAYGROUND_ACCESS_CACHE_TTL_SECONDS)
+
 
 def _now():
     return datetime.utcnow()
 
+def _oid(id_: str) -> Optional[ObjectId]:
+    try:
+        return ObjectId(id_)
+    except (InvalidId, TypeError):
+        return None
+
 async def create_playground(name: str, owner_id: str):
     db = get_db()
     now = _now()
@@ -43,10 +57,34 @@ async def get_playground(playground_id: str):
         pg["messages"] = []
     return pg
 
-async def is_member(playground_id: str, user_id: str) -> bool:
+async def get_access(playground_id: str) -> Optional[dict]:
+    """
+    {"owner": id, "members": frozenset of ids} for a playground, or None if it
+    doesn't exist. Cached; invite, leave and delete invalidate it.
+    """
+    cached = _ACCESS.get(playground_id)
+    if cached is not None:
+        return cached
+    oid = _oid(playground_id)
+    if oid is None:
+        return None
     db = get_db()
-    pg = await db.playgrounds.find_one({"_id": ObjectId(playground_id), "members": ObjectId(user_id)})
-    return pg is not None
+    pg = await db.playgrounds.find_one({"_id": oid}, {"owner": 1, "members": 1})
+    if not pg:
+        return None
+    access = {"owner": str(pg["owner"]), "members": frozenset(str(m) for m in pg.get("members", []))}
+    _ACCESS.set(playground_id, access)
+    return access
+
+def invalidate_access(playground_id: str):
+    _ACCESS.pop(playground_id)
+
+async def is_member(playground_id: str, user_id: str) -> bool:
+    access = await get_access(playground_id)
+    return access is not None and user_id in access["members"]
+
+def access_stats() -> dict:
+    return _ACCESS.stats()
 
 async def list_user_playgrounds(user_id: str):
     db = get_db()
@@ -67,7 +105,7 @@ async def add_member_by_userid(playground_id: str, user_id: str):
         {"_id": ObjectId(playground_id)},
         {"$addToSet": {"members": ObjectId(user_id)}, "$set": {"updated_at": _now()}}
     )
-    return await get_playground(playground_id)
+    invalidate_access(playground_id)
 
 async def remove_member_by_userid(playground_id: str, user_id: str):
     db = get_db()
@@ -75,11 +113,12 @@ async def remove_member_by_userid(playground_id: str, user_id: str):
         {"_id": ObjectId(playground_id)},
         {"$pull": {"members": ObjectId(user_id)}, "$set": {"updated_at": _now()}}
     )
-    return await get_playground(playground_id)
+    invalidate_access(playground_id)
 
 async def delete_playground(playground_id: str):
     db = get_db()
     await db.playgrounds.delete_one({"_id": ObjectId(playground_id)})
+    invalidate_access(playground_id)
     # Optionally remove related subjects/messages
     await db.subjects.delete_many({"playground_id": ObjectId(playground_id)})
     await db.messages.delete_many({"playground_id": ObjectId(playground_id)})
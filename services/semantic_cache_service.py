@@ -0,0 +1,107 @@
+"""
+Semantic answer cache: questions are embedded with the shared MiniLM model and
+compared (cosine similarity, one matrix-vector product per lookup) against
+recent answered questions in the same scope, e.g. one PDF or one playground.
+"""
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from core import registry
+from core.config import settings
+from core.workers import io_pool
+
+
+class _Scope:
+    """Fixed-capacity ring of (unit vector, answer, stored_at) for one scope."""
+
+    def __init__(self, capacity: int, dim: int):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.stored_at = np.zeros(capacity, dtype=np.float64)
+        self.questions: list[Optional[str]] = [None] * capacity
+        self.answers: list[Optional[str]] = [None] * capacity
+        self.count = 0
+        self.next = 0
+
+    def add(self, vector: np.ndarray, question: str, answer: str):
+        i = self.next
+        self.vectors[i] = vector
+        self.stored_at[i] = time.time()
+        self.questions[i] = question
+        self.answers[i] = answer
+        self.next = (i + 1) % len(self.answers)
+        self.count = min(self.count + 1, len(self.answers))
+
+    def best(self, vector: np.ndarray, min_stored_at: float):
+        if not self.count:
+            return None, 0.0
+        sims = self.vectors[:self.count] @ vector
+        sims[self.stored_at[:self.count] < min_stored_at] = -1.0
+        i = int(np.argmax(sims))
+        return i, float(sims[i])
+
+
+_SCOPES: OrderedDict[str, _Scope] = OrderedDict()
+_COUNTERS = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0}
+
+
+def _normalize(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+async def embed(text: str) -> np.ndarray:
+    vector = await io_pool.run(registry.get_embeddings().embed_query, text)
+    return _normalize(vector)
+
+
+async def lookup(scope: str, question: str, bypass: bool = False):
+    """
+    Return (cached_answer_or_None, query_vector). Pass the vector back to store()
+    so a miss doesn't embed the question twice. With bypass=True nothing is looked up.
+    """
+    if bypass or not settings.SEMANTIC_CACHE_ENABLED:
+        _COUNTERS["bypassed"] += 1
+        return None, None
+    vector = await embed(question)
+    entry = _SCOPES.get(scope)
+    if entry is not None:
+        _SCOPES.move_to_end(scope)
+        i, similarity = entry.best(vector, time.time() - settings.SEMANTIC_CACHE_TTL_SECONDS)
+        if i is not None and similarity >= settings.SEMANTIC_CACHE_THRESHOLD:
+            _COUNTERS["hits"] += 1
+            return entry.answers[i], vector
+    _COUNTERS["misses"] += 1
+    return None, vector
+
+
+def store(scope: str, vector: Optional[np.ndarray], question: str, answer: str):
+    if vector is None or not answer:
+        return
+    entry = _SCOPES.get(scope)
+    if entry is None:
+        entry = _Scope(settings.SEMANTIC_CACHE_MAX_ENTRIES, vector.shape[0])
+        _SCOPES[scope] = entry
+        while len(_SCOPES) > settings.SEMANTIC_CACHE_MAX_SCOPES:
+            _SCOPES.popitem(last=False)
+    _SCOPES.move_to_end(scope)
+    entry.add(vector, question, answer)
+    _COUNTERS["stored"] += 1
+
+
+def invalidate(scope: str):
+    _SCOPES.pop(scope, None)
+
+
+def stats() -> dict:
+    lookups = _COUNTERS["hits"] + _COUNTERS["misses"]
+    return {
+        **_COUNTERS,
+        "hit_rate": round(_COUNTERS["hits"] / lookups, 4) if lookups else 0.0,
+        "scopes": len(_SCOPES),
+        "entries": sum(s.count for s in _SCOPES.values()),
+        "threshold": settings.SEMANTIC_CACHE_THRESHOLD,
+    }
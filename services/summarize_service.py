@@ -1,11 +1,18 @@
+import asyncio
+import hashlib
 from typing import Optional
+from core import llm_gateway
 from core.config import settings
+from core.singleflight import SingleFlight
+from core.workers import fetch_pool
+from services import content_cache_service
 
 try:
     import validators
     from langchain_core.documents import Document
+    from langchain_core.output_parsers import StrOutputParser
     from langchain_core.prompts import PromptTemplate
-    from langchain_groq import ChatGroq
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
     from langchain_classic.chains import load_summarize_chain
     from langchain_community.document_loaders import YoutubeLoader, UnstructuredURLLoader
 except Exception as e:
@@ -28,6 +35,25 @@ Content:
 Return only Markdown.
 """
 
+MAP_PROMPT_TEMPLATE = """
+The text below is part {part} of {total} of a longer transcript or article.
+Write a concise summary of this part that keeps its key points, definitions,
+names, numbers and any notable quotes verbatim. Do not add an introduction.
+
+Text:
+{text}
+"""
+
+# collapse rounds before giving up and truncating the partial summaries
+MAX_COLLAPSE_ROUNDS = 3
+
+# part of the summary cache key, so editing the prompt invalidates old summaries
+PROMPT_VERSION = hashlib.sha256(PROMPT_TEMPLATE.encode("utf-8")).hexdigest()[:12]
+
+# concurrent requests for the same content share one fetch / one summary
+_FETCHES = SingleFlight("summarize_fetch")
+_SUMMARIES = SingleFlight("summarize")
+
 
 def _ensure_deps():
     if validators is None:
@@ -39,11 +65,27 @@ def _truncate(text: str, max_chars: int = 12000) -> str:
 def _build_prompt():
     return PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["text"])  # type: ignore
 
-async def summarize_youtube(url: str) -> str:
+def _load_text(url: str) -> str:
+    """Fetch the transcript (YouTube) or page content for a URL. Blocking network I/O."""
+    if "youtube.com" in url or "youtu.be" in url:
+        preferred_langs = ["en", "en-US", "en-GB"]
+        loader = YoutubeLoader.from_youtube_url(url, add_video_info=False, language=preferred_langs, translation=None)
+        docs = loader.load()
+    else:
+        loader = UnstructuredURLLoader(urls=[url], ssl_verify=False)
+        docs = loader.load()
+
+    if not docs:
+        raise RuntimeError("No content could be extracted from the provided URL")
+
+    return "\n\n".join([getattr(d, "page_content", "") for d in docs]).strip()
+
+
+async def prepare_content(url: str) -> str:
     """
-    Attempt to summarize the provided YouTube URL using the same logic as the standalone script.
-    Raises RuntimeError if required libs or API key are missing.
-    Returns the generated markdown summary as a string.
+    The transcript or page text for a URL, fetched once and cached.
+    Raises ValueError for invalid URLs, RuntimeError if deps or API key are
+    missing and WorkerPoolSaturated when the fetch pool is full.
     """
     _ensure_deps()
 
@@ -54,31 +96,124 @@ async def summarize_youtube(url: str) -> str:
     if not api_key:
         raise RuntimeError("GROQ_API_KEY not set in environment")
 
-    # Initialize LLM
-    llm = ChatGroq(model=settings.GROQ_MODEL_NAME, groq_api_key=api_key)
+    key = content_cache_service.content_key(url)
+    return await _FETCHES.do(key, lambda: _fetch(key, url))
 
-    # Load content
-    if "youtube.com" in url or "youtu.be" in url:
-        preferred_langs = ["en", "en-US", "en-GB"]
-        loader = YoutubeLoader.from_youtube_url(url, add_video_info=False, language=preferred_langs, translation=None)
-        docs = loader.load()
-    else:
-        loader = UnstructuredURLLoader(urls=[url], ssl_verify=False)
-        docs = loader.load()
 
-    if not docs:
-        raise RuntimeError("No content could be extracted from the provided URL")
+async def _fetch(key: str, url: str) -> str:
+    combined_text = await content_cache_service.content_cache.get(key)
+    if combined_text is None:
+        # loaders are synchronous; keep the fetch off the event loop
+        combined_text = await fetch_pool.run(_load_text, content_cache_service.canonical_url(url))
+        await content_cache_service.content_cache.set(key, combined_text)
+    return combined_text
+
+
+def _is_long(text: str) -> bool:
+    return settings.SUMMARIZE_LONG_MODE and len(text) > settings.SUMMARIZE_SINGLE_PASS_CHARS
+
+def _summary_key(text: str) -> str:
+    mode = "map_reduce" if _is_long(text) else "stuff"
+    return content_cache_service.summary_key(text, f"{PROMPT_VERSION}:{mode}", settings.GROQ_MODEL_NAME)
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; good enough for budgeting chunks
+    return max(1, len(text) // 4)
+
+def _split_for_map(text: str) -> list[str]:
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=settings.SUMMARIZE_CHUNK_TOKENS,
+        chunk_overlap=settings.SUMMARIZE_CHUNK_OVERLAP_TOKENS,
+        length_function=_estimate_tokens,
+    )
+    return splitter.split_text(text)
+
+
+async def _map_summaries(parts: list[str], llm) -> list[str]:
+    """Summarize all parts concurrently, at most SUMMARIZE_MAP_CONCURRENCY Groq calls at a time."""
+    semaphore = asyncio.Semaphore(settings.SUMMARIZE_MAP_CONCURRENCY)
+    chain = PromptTemplate(template=MAP_PROMPT_TEMPLATE, input_variables=["text", "part", "total"]) | llm | StrOutputParser()
+
+    async def summarize_part(index: int, text: str) -> str:
+        async with semaphore:
+            return await chain.ainvoke({"text": text, "part": index + 1, "total": len(parts)})
+
+    return await asyncio.gather(*(summarize_part(i, p) for i, p in enumerate(parts)))
+
+
+async def _reduce_input(text: str, llm) -> str:
+    """
+    Text to feed PROMPT_TEMPLATE: short content as-is, long content mapped to
+    partial summaries (collapsed again if those are still too long for one call).
+    """
+    if not _is_long(text):
+        return _truncate(text)
+    for _ in range(MAX_COLLAPSE_ROUNDS):
+        partials = await _map_summaries(_split_for_map(text), llm)
+        text = "\n\n".join(f"Part {i + 1}:\n{p}" for i, p in enumerate(partials))
+        if len(text) <= settings.SUMMARIZE_SINGLE_PASS_CHARS or len(partials) == 1:
+            break
+    return _truncate(text, settings.SUMMARIZE_SINGLE_PASS_CHARS)
 
-    combined_text = "\n\n".join([getattr(d, "page_content", "") for d in docs]).strip()
-    combined_text = _truncate(combined_text)
+
+async def summarize_youtube(url: str) -> str:
+    """
+    Attempt to summarize the provided YouTube URL using the same logic as the standalone script.
+    Content longer than SUMMARIZE_SINGLE_PASS_CHARS is summarized map-reduce style.
+    Concurrent requests for the same video/page share one summary.
+    Raises RuntimeError if required libs or API key are missing.
+    Returns the generated markdown summary as a string.
+    """
+    return await _SUMMARIES.do(content_cache_service.content_key(url), lambda: _summarize(url))
+
+
+async def _summarize(url: str) -> str:
+    combined_text = await prepare_content(url)
+    key = _summary_key(combined_text)
+    cached = await content_cache_service.summary_cache.get(key)
+    if cached is not None:
+        return cached
+
+    llm = llm_gateway.chat_model(caller="summarize")
+    content = await _reduce_input(combined_text, llm)
 
     chain = load_summarize_chain(llm, chain_type="stuff", prompt=_build_prompt())
-    single_doc = Document(page_content=combined_text, metadata={})
-    out = chain.invoke({"input_documents": [single_doc]})
+    single_doc = Document(page_content=content, metadata={})
+    out = await chain.ainvoke({"input_documents": [single_doc]})
 
     # chain.invoke can return a string or dict depending on chain implementation
     if isinstance(out, dict) and "output_text" in out:
-        return out["output_text"]
-    if isinstance(out, str):
-        return out
-    return str(out)
+        summary = out["output_text"]
+    elif isinstance(out, str):
+        summary = out
+    else:
+        summary = str(out)
+    await content_cache_service.summary_cache.set(key, summary)
+    return summary
+
+
+async def stream_summarize_youtube(url: str, combined_text: Optional[str] = None):
+    """
+    Async generator variant of summarize_youtube that yields Markdown tokens as they are generated.
+    Long content first yields a {"stage": "map"} progress dict while the parts are summarized.
+    Pass the result of prepare_content() as `combined_text` if it was already fetched.
+    """
+    if combined_text is None:
+        combined_text = await prepare_content(url)
+    key = _summary_key(combined_text)
+    cached = await content_cache_service.summary_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    llm = llm_gateway.chat_model(caller="summarize")
+    if _is_long(combined_text):
+        yield {"stage": "map", "chars": len(combined_text)}
+    content = await _reduce_input(combined_text, llm)
+
+    parts = []
+    async for chunk in (_build_prompt() | llm).astream({"text": content}):
+        if chunk.content:
+            parts.append(chunk.content)
+            yield chunk.content
+    await content_cache_service.summary_cache.set(key, "".join(parts))
@@ -1,93 +1,472 @@
+import json
 import re
 
+from services import flowchart_graph
+
+# skips plain text and whole JSON strings in C, stopping at the next brace, at
+# the quote of a string that was cut off, or at the end of the text
+_NEXT_BRACE = re.compile(r'(?:[^{}"]+|"[^"\\]*(?:\\.[^"\\]*)*")*([{}"]|$)')
+# FlowchartStreamParser only stops on these; everything in between is skipped in C
+_STRUCTURAL = re.compile(r'[{}\[\]"]')
+_STRING_STOP = re.compile(r'["\\]')
+_DECODER = json.JSONDecoder()
+_REPAIR_TOKENS = re.compile(r'[{}\[\]",\\]')
+
+# how each generation's output was turned into a flowchart; see record_generation()
+_COUNTERS = {
+    "clean": 0,
+    "repaired": 0,
+    "continued": 0,
+    "failed": 0,
+    "dropped_nodes": 0,
+    "dropped_edges": 0,
+    "continuation_tokens": 0,
+    "refinements": 0,
+    "refine_tokens": 0,
+    # graph problems check_graph() found in flowcharts that were served
+    "cyclic": 0,
+    "orphan_nodes": 0,
+}
+
+PATCH_KEYS = ("add_nodes", "update_nodes", "remove_nodes", "add_edges", "remove_edges")
+
+
+def _object_span(text: str):
+    """
+    (start, end, parsed) of the longest top-level {...} block in model output;
+    `parsed` is the decoded object when the block came from the fast path, else None.
+    """
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("No valid JSON object found in model response")
+    best = None
+    parsed = None
+    try:
+        parsed, end = _DECODER.raw_decode(text, start)
+    except json.JSONDecodeError:
+        pass
+    else:
+        # the common case, one object after optional prose or a fence, costs a single C decode
+        best = (start, end)
+        start = text.find("{", end)
+        if start == -1:
+            return best[0], best[1], parsed
+
+    while start != -1:
+        depth = 0
+        end = None
+        for match in _NEXT_BRACE.finditer(text, start):
+            ch = match.group(1)
+            if ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    end = match.end()
+                    break
+            else:
+                break  # end of text, or an unterminated string: the output was cut off
+        if end is None:
+            break  # unbalanced to the end of the text, so nothing later can close either
+        if best is None or end - start > best[1] - best[0]:
+            best = (start, end)
+            parsed = None
+        start = text.find("{", end)
+
+    if best is None:
+        raise ValueError("No valid JSON object found in model response")
+    return best[0], best[1], parsed
+
+
 def extract_json(text: str) -> str:
     """
-    Strips markdown fences and extracts the raw JSON string.
-    Mirrors the extractJson() function from the Node.js version.
+    Returns the raw JSON object from the model output.
+    Prose and markdown fences around it are ignored, braces inside JSON strings
+    don't count, and if the text holds several top-level {...} blocks (e.g. a
+    stray "{id}" in a sentence before the answer) the longest one wins.
     """
-    # Remove ```json ... ``` or ``` ... ```
-    cleaned = re.sub(r"```(?:json)?", "", text).strip().strip("`").strip()
+    start, end, _ = _object_span(text)
+    return text[start:end]
 
-    # If it starts with { it's probably clean already
-    if cleaned.startswith("{"):
-        return cleaned
 
-    # Last resort: find the outermost { ... } block
-    match = re.search(r"\{.*\}", cleaned, re.DOTALL)
-    if match:
-        return match.group()
+def parse_json(text: str):
+    """
+    extract_json() + json.loads() in one step, picking the same block. Clean
+    output is decoded once, by the C scanner, straight from the first '{'.
+    """
+    start, end, parsed = _object_span(text)
+    return parsed if parsed is not None else json.loads(text[start:end])
+
 
-    raise ValueError("No valid JSON object found in model response")
+def repair_json(text: str) -> str:
+    """
+    Best-effort fix-up of model JSON that failed to parse. Trailing commas are
+    dropped, a missing comma between adjacent objects/arrays in an array is
+    inserted, and if the output was cut off (e.g. at max_tokens) it is trimmed
+    back to the last complete value and every array/object still open is closed.
+    Raises ValueError when there is nothing to repair.
+    """
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("No JSON object found in model response")
 
+    out: list[str] = []   # repaired text is "".join(out) + text[copied:...]
+    copied = start
+    stack: list[str] = []  # closers for the arrays/objects currently open
+    in_string = False
+    skip_to = -1
+    last = None            # last structural character outside strings
+    last_end = start
+    comma_at = -1
+    safe = None            # (len(out), copied, end, closers) of the last valid prefix
+    end = None
 
-def validate_flowchart(data: dict) -> bool:
+    for match in _REPAIR_TOKENS.finditer(text, start):
+        pos = match.start()
+        if pos < skip_to:
+            continue
+        ch = match.group()
+        if in_string:
+            if ch == "\\":
+                skip_to = pos + 2
+            elif ch == '"':
+                in_string = False
+                last, last_end = '"', pos + 1
+            continue
+
+        only_space = not text[last_end:pos].strip()
+        if ch == '"':
+            in_string = True
+            continue
+        if ch in "{[":
+            if last in ("}", "]") and only_space and stack and stack[-1] == "]":
+                out.append(text[copied:pos])
+                out.append(",")
+                copied = pos
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if last == "," and only_space:
+                out.append(text[copied:comma_at])
+                copied = comma_at + 1
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                end = pos + 1
+                break
+            safe = (len(out), copied, pos + 1, "".join(reversed(stack)))
+        elif ch == ",":
+            if last not in (",", "{", "[", None):
+                safe = (len(out), copied, pos, "".join(reversed(stack)))
+            comma_at = pos
+        last, last_end = ch, pos + 1
+
+    if end is not None:
+        return "".join(out) + text[copied:end]
+    if safe is None:
+        raise ValueError("Model response was cut off before any complete value")
+    pieces, copied, cut, closers = safe
+    return "".join(out[:pieces]) + text[copied:cut] + closers
+
+
+def sanitize_flowchart(data: dict) -> tuple[int, int]:
     """
-    Mirrors the validateFlowChart() function from the Node.js version.
-    Checks that nodes have id/label and edges have from/to.
+    Drop nodes without id/label (or repeating an earlier id) and edges without
+    from/to or pointing at a node that doesn't exist, in place.
+    Returns (dropped_nodes, dropped_edges).
     """
     if not isinstance(data, dict):
-        return False
-    if "nodes" not in data or "edges" not in data:
-        return False
-    if not isinstance(data["nodes"], list) or not isinstance(data["edges"], list):
-        return False
+        return 0, 0
+    nodes = data.get("nodes") if isinstance(data.get("nodes"), list) else []
+    edges = data.get("edges") if isinstance(data.get("edges"), list) else []
 
-    # Validate nodes
+    kept_nodes = []
     node_ids = set()
-    for node in data["nodes"]:
-        if not isinstance(node, dict):
-            return False
-        if "id" not in node or "label" not in node:
-            return False
-        node_ids.add(node["id"])
+    for node in nodes:
+        if isinstance(node, dict) and "id" in node and "label" in node and node["id"] not in node_ids:
+            kept_nodes.append(node)
+            node_ids.add(node["id"])
+    kept_edges = [
+        e for e in edges
+        if isinstance(e, dict) and e.get("from") in node_ids and e.get("to") in node_ids
+    ]
+    data["nodes"], data["edges"] = kept_nodes, kept_edges
+    return len(nodes) - len(kept_nodes), len(edges) - len(kept_edges)
+
+
+def recover_flowchart(raw: str):
+    """
+    Turn model output into a valid flowchart, repairing it locally when it
+    doesn't parse or has dangling nodes/edges.
+    Returns (flowchart, outcome, dropped_nodes, dropped_edges) where outcome is
+    "clean", "repaired" or "failed" (flowchart is None only for "failed").
+    """
+    outcome = "clean"
+    try:
+        data = parse_json(raw)
+    except ValueError:
+        try:
+            data = json.loads(repair_json(raw))
+        except ValueError:
+            return None, "failed", 0, 0
+        outcome = "repaired"
+
+    dropped_nodes, dropped_edges = sanitize_flowchart(data)
+    if dropped_nodes or dropped_edges:
+        outcome = "repaired"
+    if not isinstance(data, dict) or not data.get("nodes") or not validate_flowchart(data):
+        return None, "failed", dropped_nodes, dropped_edges
+    return data, outcome, dropped_nodes, dropped_edges
+
+
+def record_generation(outcome: str, dropped_nodes: int = 0, dropped_edges: int = 0, continuation_tokens: int = 0):
+    """Count how one generation ended: "clean", "repaired", "continued" or "failed"."""
+    _COUNTERS[outcome] += 1
+    _COUNTERS["dropped_nodes"] += dropped_nodes
+    _COUNTERS["dropped_edges"] += dropped_edges
+    _COUNTERS["continuation_tokens"] += continuation_tokens
+
+
+def record_refinement(completion_tokens: int):
+    _COUNTERS["refinements"] += 1
+    _COUNTERS["refine_tokens"] += completion_tokens
+
+
+def stats() -> dict:
+    total = _COUNTERS["clean"] + _COUNTERS["repaired"] + _COUNTERS["continued"] + _COUNTERS["failed"]
+    # every repaired or continued generation is a 502 (and a full re-submit) avoided
+    rescued = _COUNTERS["repaired"] + _COUNTERS["continued"]
+    return {
+        **_COUNTERS,
+        "generations": total,
+        "rescued": rescued,
+        "failure_rate": round(_COUNTERS["failed"] / total, 4) if total else 0.0,
+        "avg_refine_tokens": round(_COUNTERS["refine_tokens"] / _COUNTERS["refinements"]) if _COUNTERS["refinements"] else 0,
+    }
 
-    # Validate edges
-    for edge in data["edges"]:
-        if not isinstance(edge, dict):
-            return False
-        if "from" not in edge or "to" not in edge:
-            return False
-        # Ensure edge references existing nodes
-        if edge["from"] not in node_ids or edge["to"] not in node_ids:
-            return False
 
-    return True
+def compact_flowchart(flowchart: dict) -> str:
+    """
+    One line per node ("id | label | level") and per edge ("from -> to"): what
+    the model needs to write a patch, without resending every node's details.
+    """
+    lines = ["NODES:"]
+    lines += [f"{n['id']} | {n['label']} | {n.get('level', '?')}" for n in flowchart["nodes"]]
+    lines.append("EDGES:")
+    lines += [f"{e['from']} -> {e['to']}" for e in flowchart["edges"]]
+    return "\n".join(lines)
+
+
+def _patch_list(patch: dict, key: str) -> list:
+    value = patch.get(key)
+    return value if isinstance(value, list) else []
+
+
+def _edge_key(edge: dict) -> tuple[str, str]:
+    return str(edge.get("from")), str(edge.get("to"))
+
+
+def apply_patch(flowchart: dict, patch) -> dict:
+    """
+    Apply a refinement patch and return the new flowchart (the input is not modified):
+      {"add_nodes": [node], "update_nodes": [{"id", <changed fields>}], "remove_nodes": [id],
+       "add_edges": [{"from", "to"}], "remove_edges": [{"from", "to"}]}
+    Missing keys mean no change; removing a node also removes its edges.
+    Raises ValueError for a malformed patch or one that leaves no nodes.
+    """
+    if not isinstance(patch, dict) or not any(key in patch for key in PATCH_KEYS):
+        raise ValueError("Refinement patch is empty or malformed")
+
+    nodes = {n["id"]: dict(n) for n in flowchart["nodes"]}
+    for node_id in _patch_list(patch, "remove_nodes"):
+        if isinstance(node_id, str):
+            nodes.pop(node_id, None)
+    for change in _patch_list(patch, "update_nodes"):
+        if isinstance(change, dict) and change.get("id") in nodes:
+            nodes[change["id"]].update(change)
+    for node in _patch_list(patch, "add_nodes"):
+        if isinstance(node, dict) and isinstance(node.get("id"), str) and "label" in node:
+            nodes[node["id"]] = {**nodes.get(node["id"], {}), **node}
+
+    removed = {_edge_key(e) for e in _patch_list(patch, "remove_edges") if isinstance(e, dict)}
+    edges = []
+    seen = set()
+    for edge in flowchart["edges"] + _patch_list(patch, "add_edges"):
+        if not isinstance(edge, dict) or _edge_key(edge) in removed or _edge_key(edge) in seen:
+            continue
+        seen.add(_edge_key(edge))
+        edges.append(dict(edge))
+
+    result = {"nodes": list(nodes.values()), "edges": edges}
+    sanitize_flowchart(result)
+    if not result["nodes"]:
+        raise ValueError("Refinement would remove every node")
+    return result
+
+
+def validate_flowchart(data: dict) -> bool:
+    """
+    Mirrors the validateFlowChart() function from the Node.js version.
+    Checks that nodes have id/label and edges have from/to between existing nodes.
+    """
+    return not flowchart_graph.structural_errors(data)
 
 
 def assign_levels(data: dict) -> dict:
     """
-    If the model forgot to include 'level' on nodes, compute them
-    via BFS from the first node so the frontend always has level data.
+    If the model forgot to include 'level' on nodes, compute them as the BFS
+    distance from the nearest root so the frontend always has level data.
     """
-    node_ids = [n["id"] for n in data["nodes"]]
-    if not node_ids:
+    if not data["nodes"]:
         return data
 
     # Check if levels are already present and valid
     if all("level" in n and isinstance(n["level"], int) for n in data["nodes"]):
         return data
 
-    # Build adjacency list
-    adj: dict[str, list[str]] = {nid: [] for nid in node_ids}
-    for edge in data["edges"]:
-        src, tgt = edge["from"], edge["to"]
-        if src in adj:
-            adj[src].append(tgt)
-
-    # BFS from root node
-    levels: dict[str, int] = {}
-    queue = [node_ids[0]]
-    levels[node_ids[0]] = 0
-
-    while queue:
-        current = queue.pop(0)
-        for neighbor in adj.get(current, []):
-            if neighbor not in levels:
-                levels[neighbor] = levels[current] + 1
-                queue.append(neighbor)
-
-    # Assign levels — default 0 for any unreachable nodes
+    levels = flowchart_graph.compute_levels(*flowchart_graph.adjacency(data["nodes"], data["edges"]))
     for node in data["nodes"]:
-        node["level"] = levels.get(node["id"], 0)
+        node["level"] = levels[node["id"]]
 
     return data
+
+
+def check_graph(data: dict) -> dict:
+    """
+    One flowchart_graph.analyze() pass over a sanitized flowchart: fills in
+    levels like assign_levels() when any is missing, and returns the problems
+    the schema checks can't see as {"cycles": [[id, ...]], "orphans": [id]}
+    (nodes in a loop, nodes with no edges at all) so the client can show them.
+    """
+    report = flowchart_graph.analyze(data)
+    if not all(isinstance(n.get("level"), int) for n in data["nodes"]):
+        for node in data["nodes"]:
+            node["level"] = report["levels"][node["id"]]
+    _COUNTERS["cyclic"] += bool(report["cycles"])
+    _COUNTERS["orphan_nodes"] += len(report["orphans"])
+    return {"cycles": report["cycles"], "orphans": report["orphans"]}
+
+
+class FlowchartStreamParser:
+    """
+    Incremental parser for a flowchart JSON document arriving in pieces.
+
+    feed() takes the next chunk of model output and returns the node/edge
+    objects that chunk completed, as ("node" | "edge", dict) pairs. Text before
+    the first '{' (prose, markdown fences) is ignored. Nodes are emitted as soon
+    as they close; an edge is held back until both of its endpoints have been
+    seen; finish() drops any whose endpoints never arrived.
+    """
+
+    def __init__(self):
+        self.nodes: list[dict] = []
+        self.edges: list[dict] = []
+        self.node_ids: set = set()
+        self.pending_edges: list[dict] = []
+        self.rejected = 0
+        self._depth = 0
+        self._in_string = False
+        self._skip = 0
+        self._key: list[str] | None = None
+        self._last_key = None
+        self._section = None
+        self._element: list[str] | None = None
+        self._done = False
+
+    def feed(self, text: str) -> list[tuple[str, dict]]:
+        events: list[tuple[str, dict]] = []
+        n = len(text)
+        pos = self._skip  # an escaped character carried over from the previous chunk
+        self._skip = 0
+        # where the still-uncopied part of an open element / key string starts in this chunk
+        element_mark = key_mark = 0
+        while pos < n and not self._done:
+            if self._in_string:
+                match = _STRING_STOP.search(text, pos)
+                if match is None:
+                    pos = n
+                    break
+                pos = match.start()
+                if text[pos] == "\\":
+                    pos += 2
+                    continue
+                self._in_string = False
+                if self._key is not None:
+                    self._key.append(text[key_mark:pos])
+                    self._last_key = "".join(self._key)
+                    self._key = None
+                pos += 1
+                continue
+
+            match = _STRUCTURAL.search(text, pos)
+            if match is None:
+                pos = n
+                break
+            pos = match.start()
+            ch = text[pos]
+            if ch == '"':
+                if self._depth:
+                    self._in_string = True
+                    if self._depth == 1:
+                        self._key = []
+                        key_mark = pos + 1
+            elif ch in "{[":
+                if self._depth or ch == "{":
+                    self._depth += 1
+                    if ch == "[" and self._depth == 2 and self._last_key in ("nodes", "edges"):
+                        self._section = self._last_key
+                    elif ch == "{" and self._depth == 3 and self._section and self._element is None:
+                        self._element = []
+                        element_mark = pos
+            elif self._depth:
+                self._depth -= 1
+                if ch == "}" and self._depth == 2 and self._element is not None:
+                    self._element.append(text[element_mark:pos + 1])
+                    events.extend(self._close_element("".join(self._element)))
+                    self._element = None
+                elif ch == "]" and self._depth == 1:
+                    self._section = None
+                elif self._depth == 0:
+                    # a stray {...} in prose before the answer doesn't count
+                    self._done = bool(self.nodes or self.edges or self.pending_edges)
+                    self._last_key = None
+            pos += 1
+
+        self._skip = max(pos - n, 0)
+        if self._element is not None:
+            self._element.append(text[element_mark:])
+        if self._key is not None:
+            self._key.append(text[key_mark:])
+        return events
+
+    def _close_element(self, raw: str) -> list[tuple[str, dict]]:
+        try:
+            obj = json.loads(raw)
+        except json.JSONDecodeError:
+            self.rejected += 1
+            return []
+        if self._section == "nodes":
+            if not isinstance(obj, dict) or "id" not in obj or "label" not in obj or obj["id"] in self.node_ids:
+                self.rejected += 1
+                return []
+            self.nodes.append(obj)
+            self.node_ids.add(obj["id"])
+            # edges that were waiting for this node may be complete now
+            ready = [e for e in self.pending_edges if e["from"] in self.node_ids and e["to"] in self.node_ids]
+            self.pending_edges = [e for e in self.pending_edges if e not in ready]
+            self.edges.extend(ready)
+            return [("node", obj)] + [("edge", e) for e in ready]
+        if not isinstance(obj, dict) or "from" not in obj or "to" not in obj:
+            self.rejected += 1
+            return []
+        if obj["from"] in self.node_ids and obj["to"] in self.node_ids:
+            self.edges.append(obj)
+            return [("edge", obj)]
+        self.pending_edges.append(obj)
+        return []
+
+    def finish(self) -> dict:
+        """Drop edges whose endpoints never appeared and return the assembled flowchart."""
+        self.rejected += len(self.pending_edges)
+        self.pending_edges = []
+        return {"nodes": self.nodes, "edges": self.edges}
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+import aiofiles
+from fastapi import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from core.config import settings
+
+PDF_MAGIC = b"%PDF-"
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Upload exceeds the maximum size of {max_bytes // (1024 * 1024)} MB")
+        self.max_bytes = max_bytes
+
+
+class _PdfSpool:
+    """The file part of an upload as it arrives: magic check, size limit and hashing on the way to disk."""
+
+    def __init__(self, max_bytes: int, filename: Optional[str]):
+        self.max_bytes = max_bytes
+        self.filename = filename
+        os.makedirs(settings.UPLOAD_SPOOL_DIR, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(suffix=".pdf", dir=settings.UPLOAD_SPOOL_DIR)
+        os.close(fd)
+        self.out = None
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+
+    async def write(self, chunk: bytes):
+        if self.out is None:
+            self.out = await aiofiles.open(self.path, "wb")
+        if len(self.head) < len(PDF_MAGIC):
+            self.head += chunk[:len(PDF_MAGIC)]
+            if not PDF_MAGIC.startswith(self.head[:len(PDF_MAGIC)]):
+                raise ValueError("Uploaded file is not a PDF")
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        self.digest.update(chunk)
+        await self.out.write(chunk)
+
+    async def close(self) -> dict:
+        if self.out is not None:
+            await self.out.close()
+        if self.size == 0:
+            raise ValueError("Uploaded file is empty")
+        if len(self.head) < len(PDF_MAGIC):
+            raise ValueError("Uploaded file is not a PDF")
+        return {"path": self.path, "sha256": self.digest.hexdigest(), "size": self.size, "filename": self.filename}
+
+    async def discard(self):
+        if self.out is not None:
+            await self.out.close()
+        release_spooled(self.path)
+
+
+async def spool_pdf_request(request: Request, file_field: str = "pdf_file", max_bytes: int | None = None) -> tuple[Optional[dict], dict]:
+    """
+    Parse a multipart/form-data request straight off the socket. The `file_field`
+    part is written to a spool file chunk by chunk and hashed on the way; the
+    other parts are returned as form fields. The request must not also declare
+    File/Form parameters, or Starlette buffers the whole body before this runs.
+
+    An oversized Content-Length is refused before anything is read, and the
+    limit is enforced again as bytes arrive for chunked uploads.
+    Returns (spooled, fields); spooled is {path, sha256, size, filename} or None
+    if the file part is missing, and the caller must release_spooled() its path.
+    Raises UploadTooLarge past the size limit and ValueError for malformed,
+    empty or non-PDF uploads.
+    """
+    max_bytes = max_bytes or settings.PDF_MAX_UPLOAD_BYTES
+    max_body = max_bytes + settings.UPLOAD_FORM_MAX_BYTES
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise ValueError("Expected a multipart/form-data upload")
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_body:
+        raise UploadTooLarge(max_bytes)
+
+    # the parser's callbacks are synchronous; they queue events that are handled after each write()
+    events: list = []
+    header = {"field": b"", "value": b""}
+    headers: dict = {}
+
+    def on_header_end():
+        headers[header["field"].lower()] = header["value"]
+        header["field"] = header["value"] = b""
+
+    def on_headers_finished():
+        events.append(("part", dict(headers)))
+        headers.clear()
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+    })
+
+    spool: Optional[_PdfSpool] = None
+    spooled: Optional[dict] = None
+    fields: dict = {}
+    field_name: Optional[str] = None
+    field_bytes = 0
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_body:
+                raise UploadTooLarge(max_bytes)
+            parser.write(chunk)
+            for kind, value in events:
+                if kind == "part":
+                    _, disposition = parse_options_header(value.get(b"content-disposition", b""))
+                    name = disposition.get(b"name", b"").decode("utf-8", "replace")
+                    if name == file_field and b"filename" in disposition and spooled is None and spool is None:
+                        spool = _PdfSpool(max_bytes, disposition[b"filename"].decode("utf-8", "replace"))
+                        field_name = None
+                    else:
+                        field_name = name
+                        fields[name] = b""
+                elif kind == "data":
+                    if spool is not None:
+                        await spool.write(value)
+                    elif field_name is not None:
+                        field_bytes += len(value)
+                        if field_bytes > settings.UPLOAD_FORM_MAX_BYTES:
+                            raise ValueError("Form fields are too large")
+                        fields[field_name] += value
+                elif spool is not None:
+                    spooled = await spool.close()
+                    spool = None
+            events.clear()
+        parser.finalize()
+        if spool is not None:
+            raise ValueError("Upload ended before the file was complete")
+    except BaseException:
+        if spool is not None:
+            await spool.discard()
+        if spooled is not None:
+            release_spooled(spooled["path"])
+        raise
+
+    return spooled, {name: value.decode("utf-8", "replace") for name, value in fields.items()}
+
+
+def release_spooled(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass